@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import dj_database_url
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,6 +41,7 @@ SHARED_APPS = [
     'django.contrib.admin',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # registers OpClass for index expressions (comment_thread_upper_idx)
     'corsheaders',              # optional but typically shared
 ]
 
@@ -71,8 +73,38 @@ TENANT_MODEL = "tenants.Client" # app.Model
 
 TENANT_DOMAIN_MODEL = "tenants.Domain"  # app.Model
 
+# Hostname -> tenant cache of tenants.middleware.CachedTenantMiddleware, per process
+TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', '1000'))
+TENANT_CACHE_TIMEOUT = int(os.getenv('TENANT_CACHE_TIMEOUT', '60'))  # seconds
+
+# Token -> user cache of comments.authentication.CachedTokenAuthentication, per process
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', '60'))  # seconds
+# Age in seconds after which API tokens are refused, 0 for tokens that never expire
+TOKEN_EXPIRY = int(os.getenv('TOKEN_EXPIRY', '0'))
+
+# Request instrumentation (comments.metrics): share of requests timed, 0 to turn it off
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '0'))
+# Bearer token for scraping /metrics; without it only staff sessions may read it
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# N+1 and query budget checks (comments.querycheck): 'off', 'log' or 'raise'
+QUERY_INSPECTION = os.getenv('QUERY_INSPECTION', 'raise' if sys.argv[1:2] == ['test'] else 'log')
+# Share of requests checked in 'log' mode; each costs a regex per query
+QUERY_INSPECTION_SAMPLE_RATE = float(os.getenv('QUERY_INSPECTION_SAMPLE_RATE', '1' if DEBUG else '0.05'))
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', '20'))
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', '5'))  # runs of one statement shape
+
+# Seconds behind its watermark each incremental `rollup_activity` pass recounts,
+# for writes that commit after the pass that should have counted them
+ROLLUP_OVERLAP = int(os.getenv('ROLLUP_OVERLAP', '60'))
+
+# Concurrent schemas in `manage.py migrate_tenants`
+TENANT_MIGRATION_PROCESSES = int(os.getenv('TENANT_MIGRATION_PROCESSES', '4'))
+
 MIDDLEWARE = [
-    'django_tenants.middleware.main.TenantMainMiddleware',
+    'tenants.middleware.CachedTenantMiddleware',
+    'comments.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -83,6 +115,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
     "allauth.account.middleware.AccountMiddleware",
+    'comments.querycheck.QueryInspectionMiddleware',
 ]
 
 ROOT_URLCONF = 'accthreads.urls'
@@ -110,12 +143,34 @@ WSGI_APPLICATION = 'accthreads.wsgi.application'
 
 DATABASE_URL = os.getenv('DATABASE_URL', 'postgres://postgres@db:5432/thrd')
 
+# Keep this 0 under the ASGI server (see the Dockerfile): sync views run in
+# a fresh thread per request, and each thread would keep its own idle
+# connection open until it aged out. psycopg2 has no pool to share them.
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', '0'))
+
 DATABASES = {
-    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
+    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=CONN_MAX_AGE)
 }
 
 DATABASES['default']['ENGINE'] = 'django_tenants.postgresql_backend'
 
+# Read replicas for comment reads (comments.routers), comma-separated URLs.
+# Pointing one at DATABASE_URL runs the routing against a single database;
+# tests always mirror default.
+DATABASE_REPLICAS = []
+for i, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(','))):
+    DATABASES[f'replica_{i}'] = {
+        **dj_database_url.parse(url, conn_max_age=CONN_MAX_AGE),
+        'ENGINE': 'django_tenants.postgresql_backend',
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{i}')
+if sys.argv[1:2] == ['test'] and not DATABASE_REPLICAS:
+    # An alias for the routing tests to switch on; they set DATABASE_REPLICAS themselves
+    DATABASES['replica_0'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+# Seconds a client reads from default after writing, to see its own writes
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -179,14 +234,68 @@ REST_USE_JWT = False
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'comments.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
-    ]
+    ],
+    # Token buckets per tenant, user or IP and scope (comments.throttling);
+    # a tenant overrides these in Client.throttle_rates
+    'DEFAULT_THROTTLE_CLASSES': [
+        'comments.throttling.TenantRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'comment_write': os.getenv('THROTTLE_COMMENT_WRITE', '30/minute'),
+        'like': os.getenv('THROTTLE_LIKE', '60/minute'),
+        'anonymous_login': os.getenv('THROTTLE_ANONYMOUS_LOGIN', '10/hour'),
+    },
+    # Reverse proxies in front of gunicorn (the TLS terminator). Throttles identify
+    # anonymous clients by the X-Forwarded-For entry this many hops back, and by
+    # REMOTE_ADDR when 0; more than are really there lets clients pick their own
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1')),
 }
 
+REST_AUTH = {
+    # Replaces expired tokens on login (TOKEN_EXPIRY)
+    'TOKEN_CREATOR': 'comments.authentication.create_token',
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Keys are prefixed with the tenant schema; any backend (locmem, file, redis) works.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'accthreads'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000')),  # locmem evicts least recently used
+        },
+        'KEY_FUNCTION': 'django_tenants.cache.make_key',
+        'REVERSE_KEY_FUNCTION': 'django_tenants.cache.reverse_key',
+    }
+}
+
+# Thread read cache (comments.cache)
+THREAD_CACHE_ALIAS = 'default'
+THREAD_CACHE_TIMEOUT = int(os.getenv('THREAD_CACHE_TIMEOUT', '300'))
+
+# Live thread events (comments.events): 'comments.events.InProcessBackend' for a
+# single process, 'comments.events.PostgresBackend' to fan out across workers
+COMMENT_EVENTS_BACKEND = os.getenv('COMMENT_EVENTS_BACKEND', 'comments.events.InProcessBackend')
+COMMENT_EVENTS_QUEUE_SIZE = 100  # per connection; a client that falls further behind gets a resync event
+COMMENT_EVENTS_HEARTBEAT = 20  # seconds
+COMMENT_EVENTS_RETRY_MS = 5000
+
+# Keyset pagination of the root comment list (comments.pagination)
+COMMENTS_PAGE_SIZE = int(os.getenv('COMMENTS_PAGE_SIZE', '50'))
+COMMENTS_MAX_PAGE_SIZE = int(os.getenv('COMMENTS_MAX_PAGE_SIZE', '200'))
+
+# Most comments accepted by one POST /api/comments/bulk/
+COMMENTS_BULK_MAX_SIZE = int(os.getenv('COMMENTS_BULK_MAX_SIZE', '200'))
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 SWAGGER_SETTINGS = {
@@ -210,6 +319,7 @@ SPECTACULAR_SETTINGS = {
 
 
 DATABASE_ROUTERS = (
+    'comments.routers.ReplicaRouter',
     'django_tenants.routers.TenantSyncRouter',
 )
 
@@ -243,3 +353,13 @@ if not DEBUG:
 else:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Notification outbox (comments.notifications), drained by `manage.py send_notifications`
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', '100'))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '8'))
+NOTIFICATION_RETRY_BACKOFF = int(os.getenv('NOTIFICATION_RETRY_BACKOFF', '30'))  # seconds, doubled per attempt
+NOTIFICATION_RETRY_MAX_DELAY = int(os.getenv('NOTIFICATION_RETRY_MAX_DELAY', '3600'))
+# Seconds a worker holds the messages it claimed; longer than sending a batch takes
+NOTIFICATION_LEASE = int(os.getenv('NOTIFICATION_LEASE', '600'))
+# Mode for users without a NotificationPreference: 'immediate', 'digest' or 'off'
+NOTIFICATION_DEFAULT_MODE = os.getenv('NOTIFICATION_DEFAULT_MODE', 'immediate')
+NOTIFICATION_DIGEST_WINDOW = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', '600'))  # seconds
@@ -24,9 +24,11 @@ from drf_spectacular.views import (
     SpectacularRedocView,
 )
 
-from comments.views import AnonymousLoginView, GoogleLogin, CustomConfirmEmailView
+from comments.views import AnonymousLoginView, GoogleLogin, CustomConfirmEmailView, NotificationPreferenceView
 
 from allauth.account.views import EmailVerificationSentView
+from tenants.views import ActivityView, TenantCacheStatsView
+from comments.metrics import metrics_view
 
 
 
@@ -51,6 +53,10 @@ urlpatterns = [
 
     path('api/auth/social/', include('allauth.socialaccount.urls')),
     path('api/comments/', include('comments.urls')),
+    path('api/notifications/preferences/', NotificationPreferenceView.as_view(), name='notification-preferences'),
+    path('api/tenants/activity/', ActivityView.as_view(), name='tenant-activity'),
+    path('api/tenants/cache-stats/', TenantCacheStatsView.as_view(), name='tenant-cache-stats'),
+    path('metrics', metrics_view, name='metrics'),
     path('api/auth/anonymous/', AnonymousLoginView.as_view(), name='anonymous_login'),
     path('api/auth/google/', GoogleLogin.as_view(), name='google-login'),
 
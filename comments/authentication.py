@@ -0,0 +1,63 @@
+"""
+Token authentication that remembers which user a token belongs to.
+
+CachedTokenAuthentication keeps (schema, token key) -> (user, token) in a
+per-process LRU (tenants.cache.TenantCache), so most authenticated requests
+skip the Token/User query. Saving or deleting a Token or User drops its
+entries in the process that made the change (comments.signals); other
+processes see it within TOKEN_CACHE_TIMEOUT seconds.
+
+Tokens older than TOKEN_EXPIRY seconds are refused when it is set; logging
+in again (create_token) replaces an expired token.
+"""
+import copy
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from tenants.cache import TenantCache
+
+token_cache = TenantCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TIMEOUT)
+
+
+def token_expired(token):
+    return bool(settings.TOKEN_EXPIRY) and token.created < timezone.now() - timedelta(seconds=settings.TOKEN_EXPIRY)
+
+
+def create_token(token_model, user, serializer=None):
+    """REST_AUTH TOKEN_CREATOR: the user's token, replaced if it has expired."""
+    token, _ = token_model.objects.get_or_create(user=user)
+    if token_expired(token):
+        token.delete()
+        token = token_model.objects.create(user=user)
+    return token
+
+
+def forget_token(key):
+    schema_name = connection.schema_name
+    token_cache.discard(lambda cache_key, entry: cache_key == (schema_name, key))
+
+
+def forget_user(user_id):
+    schema_name = connection.schema_name
+    token_cache.discard(lambda cache_key, entry: cache_key[0] == schema_name and entry[0].pk == user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache_key = (connection.schema_name, key)
+        found, entry = token_cache.get(cache_key)
+        if not found:
+            # Unknown keys and inactive users raise here and are never cached
+            entry = super().authenticate_credentials(key)
+            token_cache.set(cache_key, entry)
+        user, token = entry
+        if token_expired(token):
+            raise AuthenticationFailed(_('Token has expired.'))
+        # Views set attributes on request.user; keep the cached one pristine
+        return copy.copy(user), token
@@ -0,0 +1,163 @@
+"""
+Benchmark of the comment API (`manage.py benchmark_comments`).
+
+Builds benchmark tenants whose threads have known shapes, drives the real
+endpoints through the Django test client and measures latency, queries and
+response size per endpoint. QUERY_BUDGETS caps the queries of every
+endpoint: the shapes are large, so a change that makes an endpoint issue a
+query per reply, per like or per root blows its budget.
+"""
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client as HttpClient
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from .models import Comment
+from .querycheck import is_schema_switch
+from .views import CommentViewSet
+
+# The CommentViewSet action behind each endpoint
+ENDPOINT_ACTIONS = {
+    'list': 'list',
+    'search': 'list',
+    'retrieve wide': 'retrieve',
+    'retrieve deep': 'retrieve',
+    'retrieve liked': 'retrieve',
+    'thread tree': 'thread_tree',
+    'replies': 'replies',
+    'likers': 'likers',
+    'create': 'create',
+    'like': 'like',
+    'unlike': 'like',
+}
+
+# Queries a request runs before the view: tenant resolution, when its cache misses
+TENANT_LOOKUP_QUERIES = 1
+
+# Most queries one request of an endpoint may run, whatever the size of the
+# thread it reads: the action's CommentViewSet.query_budgets entry, which
+# QueryInspectionMiddleware enforces, plus tenant resolution.
+QUERY_BUDGETS = {
+    name: CommentViewSet.query_budgets[action] + TENANT_LOOKUP_QUERIES
+    for name, action in ENDPOINT_ACTIONS.items()
+}
+
+
+class Shapes:
+    """Threads of known shape in the current schema, built with bulk inserts."""
+
+    def __init__(self, prefix, users, width, depth, likes, rng):
+        self.prefix = prefix
+        self.users = users
+        self.width = width
+        self.depth = depth
+        self.likes = likes
+        self.rng = rng
+
+    def _reply(self, parent, text):
+        return Comment(
+            user_id=self.rng.choice(self.users), text=text, thread_id=parent.thread_id, parent=parent,
+            path=f'{parent.path}{parent.pk}/', depth=parent.depth + 1,
+        )
+
+    def _root(self, name, text):
+        return Comment.objects.create(user_id=self.rng.choice(self.users), text=text, thread_id=f'{self.prefix}/{name}')
+
+    def build(self):
+        # Wide: one root with many direct replies
+        wide = self._root('wide', 'Wide thread about emissions pathways')
+        Comment.objects.bulk_create([self._reply(wide, f'Reply {i} on emission pathways') for i in range(self.width)])
+
+        # Deep: a single chain of replies
+        deep = self._root('deep', 'Deep thread about land use')
+        parent = deep
+        for i in range(self.depth):
+            parent = self._reply(parent, f'Nested reply {i} on land use')
+            parent.save()
+
+        # Liked: a root liked by many users
+        liked = self._root('liked', 'Popular comment about energy demand')
+        Comment.liked_by.through.objects.bulk_create(
+            [Comment.liked_by.through(comment=liked, user_id=user_id) for user_id in self.users[:self.likes]],
+            ignore_conflicts=True,
+        )
+        return {'wide': wide, 'deep': deep, 'liked': liked}
+
+
+def percentile(samples, p):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[p - 1]
+
+
+class Runner:
+    """Times requests against one tenant host as one authenticated user."""
+
+    def __init__(self, host, token, results):
+        self.client = HttpClient(HTTP_HOST=host, HTTP_AUTHORIZATION=f'Token {token}')
+        self.results = results
+
+    def measure(self, name, method, path, data=None, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data, **kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: {method.upper()} {path} returned {response.status_code}')
+        result = self.results.setdefault(name, {'ms': [], 'queries': [], 'bytes': []})
+        result['ms'].append(elapsed)
+        # Counted like QueryInspectionMiddleware does, without the tenant backend's SET search_path
+        result['queries'].append(len([query for query in queries if not is_schema_switch(query['sql'])]))
+        result['bytes'].append(len(response.content))
+        return response
+
+
+def ensure_bench_user(username):
+    user, _ = User.objects.get_or_create(username=username, defaults={'email': f'{username}@example.com'})
+    token, _ = Token.objects.get_or_create(user=user)
+    return user, token.key
+
+
+def run_endpoints(runner, shapes, requests):
+    wide, deep, liked = shapes['wide'], shapes['deep'], shapes['liked']
+    for i in range(requests):
+        runner.measure('list', 'get', '/api/comments/')
+        runner.measure('search', 'get', '/api/comments/', {'search': 'energy'})
+        runner.measure('retrieve wide', 'get', f'/api/comments/{wide.pk}/')
+        runner.measure('retrieve deep', 'get', f'/api/comments/{deep.pk}/')
+        runner.measure('retrieve liked', 'get', f'/api/comments/{liked.pk}/')
+        runner.measure('thread tree', 'get', f'/api/comments/thread/{wide.thread_id}/tree/')
+        runner.measure('replies', 'get', f'/api/comments/{wide.pk}/replies/')
+        runner.measure('likers', 'get', f'/api/comments/{liked.pk}/likers/')
+        runner.measure(
+            'create', 'post', '/api/comments/',
+            {'text': f'Benchmark reply {i}', 'parent': wide.pk}, content_type='application/json',
+        )
+        runner.measure('like', 'post', f'/api/comments/{liked.pk}/like/')
+        runner.measure('unlike', 'delete', f'/api/comments/{liked.pk}/like/')
+
+
+def summarize(results):
+    summary = {}
+    for name, result in results.items():
+        summary[name] = {
+            'p50_ms': round(percentile(result['ms'], 50), 2),
+            'p95_ms': round(percentile(result['ms'], 95), 2),
+            'p99_ms': round(percentile(result['ms'], 99), 2),
+            'queries': max(result['queries']),
+            'bytes': round(statistics.mean(result['bytes'])),
+            'requests': len(result['ms']),
+        }
+    return summary
+
+
+def over_budget(summary):
+    return {
+        name: (stats['queries'], QUERY_BUDGETS[name])
+        for name, stats in summary.items()
+        if name in QUERY_BUDGETS and stats['queries'] > QUERY_BUDGETS[name]
+    }
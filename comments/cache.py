@@ -0,0 +1,128 @@
+"""
+Response cache for thread reads.
+
+Entries live under a per-(schema, scope) version number, where a scope is
+one thread (`thread:<thread_id>`) or the root listing (`roots`). Writes reset
+the version of the scopes they touch to the current time in nanoseconds,
+which orphans every cached variant of those reads at once; orphaned entries
+age out through the backend's TTL and eviction. Since a version is the time
+of the last write, written_within() tells whether a lagging replica may not
+have that write yet. The schema name is part of every key, on top of the tenant-aware
+KEY_FUNCTION in settings.CACHES, so tenants never share entries.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from .models import Comment
+
+ROOTS = 'roots'
+
+
+def _cache():
+    return caches[settings.THREAD_CACHE_ALIAS]
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+def _key(schema_name, *parts):
+    return ':'.join(['thread-cache', schema_name, *parts])
+
+
+def thread_scope(thread_id):
+    return f'thread:{thread_id}'
+
+
+def get_version(scope, schema_name=None):
+    schema_name = schema_name or connection.schema_name
+    cache = _cache()
+    key = _key(schema_name, _digest(scope), 'version')
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1, so a version key that was
+        # evicted can never come back to a number older entries were stored under.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(scopes, schema_name=None):
+    schema_name = schema_name or connection.schema_name
+    cache = _cache()
+    for scope in scopes:
+        # Set rather than incr: concurrent writers each store a new, unique
+        # number, and the version doubles as the time of the write
+        cache.set(_key(schema_name, _digest(scope), 'version'), time.time_ns(), timeout=None)
+
+
+def written_within(version, seconds):
+    """Whether the write that set `version` (or its creation) was less than `seconds` ago."""
+    return time.time_ns() - version < seconds * 1_000_000_000
+
+
+def invalidate_comment(comment):
+    """
+    Invalidate the reads that show `comment`, once the current transaction commits.
+
+    The root listing shows root comments and their reply counts, so it is only
+    affected by roots and direct replies to roots.
+    """
+    scopes = [thread_scope(comment.thread_id)]
+    if comment.depth <= 1:
+        scopes.append(ROOTS)
+    schema_name = connection.schema_name
+    transaction.on_commit(lambda: invalidate(scopes, schema_name))
+
+
+def get_comment_thread_id(pk):
+    # thread_id never changes once a comment exists, so the mapping can be kept indefinitely
+    cache = _cache()
+    key = _key(connection.schema_name, 'comment', str(pk))
+    thread_id = cache.get(key)
+    if thread_id is None:
+        thread_id = Comment.objects.filter(pk=pk).values_list('thread_id', flat=True).first()
+        if thread_id is not None:
+            cache.set(key, thread_id, timeout=None)
+    return thread_id
+
+
+def entry_key(scope, variant, version=None):
+    """Key of one cached read; fetch it before querying, so a concurrent write makes it stale."""
+    schema_name = connection.schema_name
+    if version is None:
+        version = get_version(scope, schema_name)
+    return _key(schema_name, _digest(scope), str(version), _digest(variant))
+
+
+def get_entry(key):
+    cache = _cache()
+    entry = cache.get(key)
+    _count('hits' if entry is not None else 'misses')
+    return entry
+
+
+def set_entry(key, entry):
+    _cache().set(key, entry, timeout=settings.THREAD_CACHE_TIMEOUT)
+
+
+def _count(name):
+    cache = _cache()
+    key = _key(connection.schema_name, 'stats', name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats(schema_name):
+    cache = _cache()
+    return {
+        name: cache.get(_key(schema_name, 'stats', name), 0)
+        for name in ('hits', 'misses')
+    }
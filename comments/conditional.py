@@ -0,0 +1,130 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import cache as thread_cache
+from .models import Comment
+from .routers import reading_from_replica
+
+
+def get_validators(view, request):
+    # One aggregate over the rows backing the response: newest updated_at and row count
+    state = (
+        view.get_freshness_queryset()
+        .order_by()
+        .aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    )
+    last_modified = state['last_modified']
+    fingerprint = '|'.join([
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        str(state['count']),
+        last_modified.isoformat() if last_modified else '',
+    ])
+    etag = hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return etag, timestamp
+
+
+def personalize_etag(etag, request):
+    # liked_by_me differs per user. A like changes updated_at, so the shared
+    # validators already move with it; the user only needs to be part of the tag.
+    if request.user.is_authenticated:
+        etag = hashlib.sha256(f'{etag}|{request.user.pk}'.encode()).hexdigest()[:32]
+    return quote_etag(etag)
+
+
+def _comment_nodes(data):
+    # Serialized comments in a response: pages, lists and nested replies
+    if isinstance(data, list):
+        for item in data:
+            yield from _comment_nodes(item)
+    elif isinstance(data, dict):
+        if 'results' in data:
+            yield from _comment_nodes(data['results'])
+        elif 'liked_by_me' in data:
+            yield data
+            yield from _comment_nodes(data.get('replies', []))
+
+
+def mark_liked_by_me(data, user):
+    """Fill in liked_by_me for every comment in `data` with one query."""
+    nodes = list(_comment_nodes(data))
+    liked_ids = set()
+    if nodes and user.is_authenticated:
+        liked_ids = set(
+            Comment.liked_by.through.objects
+            .filter(user=user, comment_id__in=[node['id'] for node in nodes])
+            .values_list('comment_id', flat=True)
+        )
+    for node in nodes:
+        node['liked_by_me'] = node['id'] in liked_ids
+
+
+def conditional_read(view_method):
+    """
+    Answer conditional GETs for a CommentViewSet read action, and serve the
+    payload from the thread cache when possible.
+
+    The validators come from one aggregate over `self.get_freshness_queryset()`:
+    its newest `updated_at` and its row count. Every write that changes what
+    a read returns bumps `updated_at` or the count, so a matching
+    If-None-Match / If-Modified-Since is answered with 304 before the view
+    loads or serializes anything. When `self.get_cache_scope()` names a scope,
+    payload and validators are cached together and a hit needs no query.
+
+    The cached payload is shared by all users; liked_by_me is filled in per
+    request afterwards, and the ETag varies with the user. With read replicas,
+    a replica read only fills the cache once the scope's last write is
+    REPLICA_STICKY_SECONDS old, the lag the replica routing already allows for.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        scope = self.get_cache_scope()
+        key = entry = version = None
+        if scope is not None:
+            variant = f'{self.action}|{request.accepted_renderer.format}|{request.build_absolute_uri()}'
+            version = thread_cache.get_version(scope)
+            key = thread_cache.entry_key(scope, variant, version)
+            # A client that just wrote must see its write, which a cached entry may predate
+            if not getattr(self, 'replica_pinned', False):
+                entry = thread_cache.get_entry(key)
+
+        if entry is not None:
+            shared_etag, timestamp = entry['etag'], entry['last_modified']
+        else:
+            shared_etag, timestamp = get_validators(self, request)
+        etag = personalize_etag(shared_etag, request)
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None and entry is not None:
+            response = Response(entry['data'])
+        elif response is None:
+            response = view_method(self, request, *args, **kwargs)
+            # The key holds the version read before the query, so a write landing
+            # meanwhile orphans the entry. A replica may still lack the write that
+            # set that version, though, until it is older than the replica lag.
+            if key is not None and response.status_code == 200 and not (
+                    reading_from_replica() and thread_cache.written_within(version, settings.REPLICA_STICKY_SECONDS)):
+                # Store plain JSON types rather than serializer-bound ReturnDicts
+                data = json.loads(JSONRenderer().render(response.data))
+                thread_cache.set_entry(key, {'data': data, 'etag': shared_etag, 'last_modified': timestamp})
+        if response.status_code == 200:
+            mark_liked_by_me(response.data, request.user)
+
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # Let clients keep the payload but revalidate on every poll
+            patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+        return response
+    return wrapper
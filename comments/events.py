@@ -0,0 +1,182 @@
+"""
+Fan-out of comment events to live thread subscribers (see `thread_events`).
+
+Views publish from synchronous code; subscribers are asyncio queues owned by
+streaming responses running on the ASGI event loop. The backend named by
+settings.COMMENT_EVENTS_BACKEND connects the two:
+
+- InProcessBackend only reaches subscribers in the same process. It is the
+  default, and what tests use.
+- PostgresBackend relays through LISTEN/NOTIFY on the existing database, so
+  events reach subscribers in every worker without another service.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import select
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import psycopg2
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+RESYNC = json.dumps({'type': 'resync'})
+
+
+def thread_channel(schema_name, thread_id):
+    return f'{schema_name}:{thread_id}'
+
+
+class InProcessBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, message)
+
+    @staticmethod
+    def _offer(queue, message):
+        if queue.full():
+            # The client is not keeping up; tell it to reload instead of
+            # buffering without bound.
+            while not queue.empty():
+                queue.get_nowait()
+            message = RESYNC
+        queue.put_nowait(message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=settings.COMMENT_EVENTS_QUEUE_SIZE))
+        with self._lock:
+            first = not self._subscribers[channel]
+            self._subscribers[channel].add(subscriber)
+        if first:
+            self.on_first_subscriber(channel)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                last = not self._subscribers[channel]
+                if last:
+                    del self._subscribers[channel]
+            if last:
+                self.on_last_subscriber(channel)
+
+    def on_first_subscriber(self, channel):
+        pass
+
+    def on_last_subscriber(self, channel):
+        pass
+
+
+class PostgresBackend(InProcessBackend):
+    """
+    LISTEN/NOTIFY relay. Each process keeps one dedicated listening connection,
+    served by a daemon thread, and fans notifications out to its local queues.
+    """
+    # NOTIFY payloads must stay below 8000 bytes
+    max_payload = 7900
+
+    def __init__(self):
+        super().__init__()
+        self._commands = []
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._thread = None
+
+    def publish(self, channel, message):
+        payload = json.dumps([channel, message])
+        if len(payload.encode()) > self.max_payload:
+            # Too large to relay; subscribers reload the thread instead
+            payload = json.dumps([channel, RESYNC])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self._pg_channel(channel), payload])
+
+    def on_first_subscriber(self, channel):
+        self._command(f'LISTEN "{self._pg_channel(channel)}"')
+
+    def on_last_subscriber(self, channel):
+        self._command(f'UNLISTEN "{self._pg_channel(channel)}"')
+
+    @staticmethod
+    def _pg_channel(channel):
+        # Channel names are identifiers, limited to 63 bytes
+        return 'comments_' + hashlib.sha256(channel.encode()).hexdigest()[:40]
+
+    def _command(self, sql):
+        with self._lock:
+            self._commands.append(sql)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='comment-events', daemon=True)
+                self._thread.start()
+        self._wake_w.send(b'\0')
+
+    def _connect(self):
+        db = settings.DATABASES['default']
+        pg = psycopg2.connect(
+            dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+            host=db['HOST'], port=db['PORT'] or None,
+        )
+        pg.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return pg
+
+    def _listen(self):
+        while True:
+            try:
+                self._serve(self._connect())
+            except psycopg2.Error:
+                logger.exception('Comment event listener lost its connection, reconnecting')
+                time.sleep(1)
+
+    def _serve(self, pg):
+        # (Re)subscribe to everything local clients currently follow
+        with self._lock:
+            self._commands = [f'LISTEN "{self._pg_channel(channel)}"' for channel in self._subscribers]
+        while True:
+            with self._lock:
+                commands, self._commands = self._commands, []
+            with pg.cursor() as cursor:
+                for sql in commands:
+                    cursor.execute(sql)
+            pg.poll()
+            while pg.notifies:
+                notify = pg.notifies.pop(0)
+                try:
+                    channel, message = json.loads(notify.payload)
+                except ValueError:
+                    logger.warning('Malformed comment event on %s', notify.channel)
+                    continue
+                super().publish(channel, message)
+
+            select.select([pg, self._wake_r], [], [], 30)
+            try:
+                self._wake_r.recv(4096)
+            except BlockingIOError:
+                pass
+
+
+backend = SimpleLazyObject(lambda: import_string(settings.COMMENT_EVENTS_BACKEND)())
+
+
+def publish_comment_event(event_type, comment, data):
+    """Publish `data` about `comment` to its thread's subscribers once the transaction commits."""
+    channel = thread_channel(connection.schema_name, comment.thread_id)
+    # Every subscriber gets the same message; liked_by_me would be the writer's
+    data = {key: value for key, value in data.items() if key != 'liked_by_me'}
+    message = JSONRenderer().render({'type': event_type, 'comment': data}).decode()
+    transaction.on_commit(lambda: backend.publish(channel, message))
@@ -0,0 +1,118 @@
+import json
+import random
+import subprocess
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django_tenants.utils import get_tenant_domain_model, get_tenant_model, schema_context
+
+from comments.benchmark import QUERY_BUDGETS, Runner, Shapes, ensure_bench_user, over_budget, run_endpoints, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the comment API on dedicated tenants with wide, deep and heavily liked threads: "
+        "p50/p95/p99 latency, queries and bytes per endpoint. Fails when an endpoint exceeds its query budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=2)
+        parser.add_argument('--prefix', default='bench', help='Tenants are <prefix>_<n>, served at <prefix>-<n>.localhost')
+        parser.add_argument('--width', type=int, default=200, help='Direct replies of the wide thread')
+        parser.add_argument('--depth', type=int, default=50, help='Length of the deep reply chain')
+        parser.add_argument('--likes', type=int, default=500, help='Likes on the popular comment')
+        parser.add_argument('--comments', type=int, default=0, help='Extra background comments per tenant (seed_comments)')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint and tenant')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON, to compare commits with --compare')
+        parser.add_argument('--compare', help='JSON results of an earlier run to print differences against')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = {}
+        hosts = [f"{options['prefix']}-{i}.localhost" for i in range(options['tenants'])]
+
+        # The benchmark user writes far faster than the throttles allow
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+        with override_settings(ALLOWED_HOSTS=hosts, REST_FRAMEWORK=rest_framework):
+            for i, host in enumerate(hosts):
+                tenant = self.get_or_create_tenant(f"{options['prefix']}_{i}", host)
+                with schema_context(tenant.schema_name):
+                    shapes = self.seed(tenant, options, rng)
+                    _, token = ensure_bench_user(f"{options['prefix']}-client")
+                run_endpoints(Runner(host, token, results), shapes, options['requests'])
+
+        summary = summarize(results)
+        self.report(summary, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'commit': self.commit(), 'options': self.run_options(options), 'results': summary}, f, indent=2)
+
+        exceeded = over_budget(summary)
+        if exceeded:
+            raise CommandError('Query budget exceeded: ' + ', '.join(
+                f'{name} ran {queries} queries (budget {budget})' for name, (queries, budget) in exceeded.items()
+            ))
+
+    def get_or_create_tenant(self, schema_name, host):
+        tenant = get_tenant_model().objects.filter(schema_name=schema_name).first()
+        if tenant is None:
+            self.stdout.write(f'Creating tenant {schema_name}')
+            # Client.save builds and migrates the schema
+            tenant = get_tenant_model().objects.create(schema_name=schema_name, name=f'Benchmark {schema_name}')
+        get_tenant_domain_model().objects.get_or_create(domain=host, defaults={'tenant': tenant, 'is_primary': True})
+        return tenant
+
+    def seed(self, tenant, options, rng):
+        # Start every run from the same data, so results are comparable
+        User.objects.filter(username__startswith=f"{options['prefix']}-").delete()
+        User.objects.bulk_create([
+            User(username=f"{options['prefix']}-user-{i}", email=f"{options['prefix']}-user-{i}@example.com")
+            for i in range(max(options['likes'], 1))
+        ])
+        users = list(User.objects.filter(username__startswith=f"{options['prefix']}-user-").order_by('id').values_list('id', flat=True))
+        if options['comments']:
+            call_command(
+                'seed_comments', tenant.schema_name, comments=options['comments'], threads=max(options['comments'] // 100, 1),
+                users=100, prefix=f"{options['prefix']}-background", seed=options['seed'], stdout=self.stdout,
+            )
+        shapes = Shapes(options['prefix'], users, options['width'], options['depth'], options['likes'], rng).build()
+        call_command('recount_comments', schema_name=tenant.schema_name, stdout=self.stdout)
+        for comment in shapes.values():
+            comment.refresh_from_db()
+        return shapes
+
+    def report(self, summary, compare):
+        baseline = {}
+        if compare:
+            with open(compare) as f:
+                baseline = json.load(f)['results']
+
+        header = f'{"endpoint":<16} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"budget":>7} {"bytes":>9}'
+        self.stdout.write(self.style.MIGRATE_HEADING(header))
+        for name, stats in summary.items():
+            line = (
+                f'{name:<16} {stats["p50_ms"]:>8.2f} {stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} '
+                f'{stats["queries"]:>8} {QUERY_BUDGETS.get(name, "-"):>7} {stats["bytes"]:>9}'
+            )
+            if name in baseline:
+                before = baseline[name]
+                line += (
+                    f'   p95 {stats["p95_ms"] - before["p95_ms"]:+.2f} ms,'
+                    f' queries {stats["queries"] - before["queries"]:+d},'
+                    f' bytes {stats["bytes"] - before["bytes"]:+d}'
+                )
+            self.stdout.write(line)
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run_options(self, options):
+        keys = ('tenants', 'width', 'depth', 'likes', 'comments', 'requests', 'seed')
+        return {key: options[key] for key in keys}
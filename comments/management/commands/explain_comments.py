@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django_tenants.utils import get_tenant_model, tenant_context
+
+from comments.models import Comment
+from comments.pagination import CommentCursorPagination
+from comments.search import search_comments
+
+# Added by migration 0004_comment_thread_indexes
+THREAD_INDEXES = ('comment_thread_idx', 'comment_thread_upper_idx', 'comment_parent_created_idx')
+
+
+class Command(BaseCommand):
+    help = (
+        "Print EXPLAIN ANALYZE plans and timings for the hot comment queries in a tenant schema. "
+        "Seed a dedicated schema with `seed_comments --create-tenant`, run once, run again with "
+        "--without-indexes and compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name', help='Tenant schema to inspect')
+        parser.add_argument('--thread', help='thread_id to probe (default: the newest root)')
+        parser.add_argument('--prefix', help='thread_prefix to probe (default: first 8 characters of --thread)')
+        parser.add_argument('--search', help='?search= text to probe (default: last word of the newest root)')
+        parser.add_argument(
+            '--without-indexes', action='store_true',
+            help='Plan without the thread_id / parent indexes of migration 0004. They are dropped in a '
+                 'transaction that is rolled back, which locks the table meanwhile: use a seeded schema.',
+        )
+        parser.add_argument(
+            '--cursor-depth', type=int, default=10000,
+            help='Roots to skip before the probed cursor page (default: 10000)',
+        )
+
+    def handle(self, *args, **options):
+        tenant = get_tenant_model().objects.filter(schema_name=options['schema_name']).first()
+        if tenant is None:
+            raise CommandError(f"No tenant with schema {options['schema_name']}")
+        with tenant_context(tenant):
+            root = Comment.objects.filter(parent=None).order_by('-created_at', '-id').first()
+            if root is None:
+                raise CommandError(f"No comments in schema {options['schema_name']}")
+            thread_id = options['thread'] or root.thread_id
+            prefix = options['prefix'] or thread_id[:8]
+            search = options['search'] or root.text.split()[-1]
+            roots = Comment.objects.filter(parent=None).order_by('-created_at', '-id')
+            # Position of a page deep in the root listing, as a cursor would carry it
+            position = (
+                roots.values_list('created_at', 'id')[options['cursor_depth']:options['cursor_depth'] + 1].first()
+                or (root.created_at, root.pk)
+            )
+
+            queries = {
+                'participants (perform_create)': (
+                    Comment.objects.filter(thread_id=thread_id)
+                    .exclude(user_id=root.user_id)
+                    .values_list('user__email', flat=True)
+                    .distinct()
+                ),
+                'thread_prefix filter (list)': (
+                    Comment.objects.filter(parent=None, thread_id__istartswith=prefix)
+                    .order_by('-created_at', '-id')[:50]
+                ),
+                'root listing (list)': roots[:50],
+                'root listing, deep cursor page (list)': (
+                    CommentCursorPagination.keyset_filter(roots, *position)[:50]
+                ),
+                'replies of a comment': Comment.objects.filter(parent=root).order_by('-created_at'),
+                # What SearchFilter(search_fields=['text']) used to run
+                'search, ILIKE': (
+                    Comment.objects.filter(parent=None, text__icontains=search)
+                    .order_by('-created_at', '-id')[:50]
+                ),
+                'search, tsvector (CommentSearchFilter)': search_comments(
+                    Comment.objects.filter(parent=None), search, tenant.search_config,
+                )[:50],
+            }
+
+            with transaction.atomic():
+                if options['without_indexes']:
+                    # DDL is transactional in Postgres: the indexes come back on rollback
+                    with connection.cursor() as cursor:
+                        for index in THREAD_INDEXES:
+                            cursor.execute(f'DROP INDEX {connection.ops.quote_name(index)}')
+                for name, queryset in queries.items():
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    self.stdout.write(queryset.explain(analyze=True, buffers=True))
+                    started = time.perf_counter()
+                    list(queryset)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    self.stdout.write(f"-> {elapsed:.2f} ms\n")
+                transaction.set_rollback(True)
@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from django_tenants.utils import schema_context
+
+from comments.transfer import export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream a tenant's comments, likes and users as NDJSON (see comments.transfer)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name', help='Tenant schema to export')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per server-side cursor round trip')
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            with schema_context(options['schema_name']):
+                out.writelines(export_lines(chunk_size=options['chunk_size']))
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django_tenants.utils import schema_context
+
+from comments.transfer import Importer, TransferError
+
+
+class Command(BaseCommand):
+    help = "Load an NDJSON export (see `export_comments`) into a tenant schema, in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name', help='Tenant schema to import into')
+        parser.add_argument('path', nargs='?', help='NDJSON file to read (default: stdin)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        source = open(options['path'], encoding='utf-8') if options['path'] else sys.stdin
+        try:
+            with schema_context(options['schema_name']):
+                stats = Importer(batch_size=options['batch_size']).run(source)
+        except TransferError as e:
+            raise CommandError(f'Nothing imported, {e}')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['comments']} comments, {stats['likes']} likes and {stats['users']} users"
+        ))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = "Recompute Comment.likes_count / replies_count and repair drifted rows in every tenant schema"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', dest='schema_name', help='Only repair this tenant schema')
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted rows without writing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema_name']:
+            tenants = tenants.filter(schema_name=options['schema_name'])
+
+        for tenant in tenants:
+            with tenant_context(tenant):
+                repaired = self.repair(options['dry_run'], options['batch_size'])
+            verb = 'would repair' if options['dry_run'] else 'repaired'
+            self.stdout.write(f"{tenant.schema_name}: {verb} {repaired} comment(s)")
+
+    def repair(self, dry_run, batch_size):
+        likes = (
+            Comment.liked_by.through.objects.filter(comment=OuterRef('pk'))
+            .values('comment').annotate(n=Count('*')).values('n')
+        )
+        replies = (
+            Comment.objects.filter(parent=OuterRef('pk'), is_deleted=False)
+            .values('parent').annotate(n=Count('*')).values('n')
+        )
+        drifted = (
+            Comment.objects
+            .annotate(
+                actual_likes=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)),
+                actual_replies=Coalesce(Subquery(replies, output_field=IntegerField()), Value(0)),
+            )
+            .exclude(Q(likes_count=F('actual_likes')) & Q(replies_count=F('actual_replies')))
+            .only('id', 'likes_count', 'replies_count')
+        )
+        drifted = list(drifted.iterator(chunk_size=batch_size))
+        if dry_run or not drifted:
+            return len(drifted)
+
+        for comment in drifted:
+            comment.likes_count = comment.actual_likes
+            comment.replies_count = comment.actual_replies
+        with transaction.atomic():
+            Comment.objects.bulk_update(drifted, ['likes_count', 'replies_count'], batch_size=batch_size)
+        return len(drifted)
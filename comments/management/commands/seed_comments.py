@@ -0,0 +1,84 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django_tenants.utils import get_tenant_model, schema_context
+
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = "Seed a tenant schema with synthetic users and comment threads for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name', help='Tenant schema to seed')
+        parser.add_argument('--comments', type=int, default=100_000, help='Total number of comments')
+        parser.add_argument('--threads', type=int, default=1_000, help='Number of threads (one root each)')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--prefix', default='bench', help='thread_id prefix, threads are <prefix>/chart-<n>')
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data')
+        parser.add_argument(
+            '--create-tenant', action='store_true',
+            help='Create the tenant (without a domain) when there is none with this schema',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        threads = min(options['threads'], options['comments'])
+
+        if options['create_tenant'] and not get_tenant_model().objects.filter(schema_name=options['schema_name']).exists():
+            self.stdout.write(f"Creating tenant {options['schema_name']}")
+            # Client.save builds and migrates the schema
+            get_tenant_model().objects.create(schema_name=options['schema_name'], name=f"Seeded {options['schema_name']}")
+
+        with schema_context(options['schema_name']):
+            User.objects.bulk_create(
+                [
+                    User(username=f"{options['prefix']}-user-{i}", email=f"{options['prefix']}-user-{i}@example.com")
+                    for i in range(options['users'])
+                ],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            users = list(User.objects.filter(username__startswith=f"{options['prefix']}-user-").values_list('id', flat=True))
+
+            # Roots first, then replies attached to random earlier comments of the same thread.
+            thread_ids = [f"{options['prefix']}/chart-{i}" for i in range(threads)]
+            members = []
+            paths = {}
+            for start in range(0, threads, batch_size):
+                roots = Comment.objects.bulk_create([
+                    Comment(user_id=rng.choice(users), text=f'Root comment {i}', thread_id=thread_ids[i])
+                    for i in range(start, min(start + batch_size, threads))
+                ])
+                members.extend([root.pk] for root in roots)
+                paths.update((root.pk, ('', 0)) for root in roots)
+
+            remaining = options['comments'] - threads
+            while remaining > 0:
+                batch = []
+                for _ in range(min(batch_size, remaining)):
+                    thread = rng.randrange(threads)
+                    parent_id = rng.choice(members[thread])
+                    parent_path, parent_depth = paths[parent_id]
+                    batch.append((thread, Comment(
+                        user_id=rng.choice(users),
+                        text=f'Reply in thread {thread}',
+                        thread_id=thread_ids[thread],
+                        parent_id=parent_id,
+                        path=f'{parent_path}{parent_id}/',
+                        depth=parent_depth + 1,
+                    )))
+                Comment.objects.bulk_create([comment for _, comment in batch])
+                for thread, comment in batch:
+                    members[thread].append(comment.pk)
+                    paths[comment.pk] = (comment.path, comment.depth)
+                remaining -= len(batch)
+                self.stdout.write(f"{options['comments'] - remaining} comments", ending='\r')
+
+        # bulk_create bypasses Comment.save, so fill in the reply counters afterwards.
+        call_command('recount_comments', schema_name=options['schema_name'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Seeded {options['comments']} comments in {threads} threads"))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+
+from comments.notifications import RateLimiter, deliver_pending
+
+
+class Command(BaseCommand):
+    help = "Drain the per-tenant notification outbox over batched mail connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain every schema once and exit')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--batch-size', type=int, help='Messages per connection (default: NOTIFICATION_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float, help='Maximum messages per second across all schemas')
+        parser.add_argument('--schema', dest='schema_name', help='Only drain this tenant schema')
+
+    def handle(self, *args, **options):
+        limiter = RateLimiter(options['rate'])
+        while True:
+            processed = self.drain(options['schema_name'], options['batch_size'], limiter)
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
+
+    def drain(self, schema_name, batch_size, limiter):
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if schema_name:
+            tenants = tenants.filter(schema_name=schema_name)
+
+        total = 0
+        for tenant in tenants:
+            with tenant_context(tenant):
+                while processed := deliver_pending(batch_size, limiter):
+                    total += processed
+                    self.stdout.write(f"{tenant.schema_name}: processed {processed} message(s)")
+        return total
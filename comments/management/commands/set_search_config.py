@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from django_tenants.utils import get_tenant_model, tenant_context
+
+from comments.search import set_search_config
+
+
+class Command(BaseCommand):
+    help = "Switch a tenant's comment search to another Postgres text search configuration (rebuilds the search column)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema_name', help='Tenant schema')
+        parser.add_argument('config', help="Text search configuration, e.g. 'english', 'german' or 'simple'")
+
+    def handle(self, *args, **options):
+        try:
+            tenant = get_tenant_model().objects.get(schema_name=options['schema_name'])
+        except get_tenant_model().DoesNotExist:
+            raise CommandError(f"No tenant with schema {options['schema_name']}")
+        try:
+            with tenant_context(tenant):
+                set_search_config(options['config'])
+        except DatabaseError as e:
+            raise CommandError(f"Could not switch to {options['config']!r}: {e}")
+        tenant.search_config = options['config']
+        tenant.save(update_fields=['search_config'])
+        self.stdout.write(self.style.SUCCESS(f"{tenant.schema_name} now searches with {options['config']!r}"))
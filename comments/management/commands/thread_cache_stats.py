@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+
+from comments.cache import get_stats
+
+
+class Command(BaseCommand):
+    help = "Show thread cache hit/miss counters per tenant (shared cache backends only)"
+
+    def handle(self, *args, **options):
+        for tenant in get_tenant_model().objects.exclude(schema_name=get_public_schema_name()):
+            with tenant_context(tenant):
+                stats = get_stats(tenant.schema_name)
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total if total else 0
+            self.stdout.write(f"{tenant.schema_name}: {stats['hits']} hits, {stats['misses']} misses ({ratio:.1%} hit rate)")
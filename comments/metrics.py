@@ -0,0 +1,211 @@
+"""
+Per-request timings: tenant lookup, database, serialization and mail.
+
+RequestMetricsMiddleware samples REQUEST_METRICS_SAMPLE_RATE of requests.
+For a sampled request it counts and times every query on every database
+connection, collects the `timed()` sections below, answers with a
+Server-Timing header and adds the request to this process's histograms,
+which `metrics_view` serves in the Prometheus text format. An unsampled
+request costs one random() call.
+"""
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from tenants.cache import tenant_cache
+
+from .authentication import token_cache
+
+_current = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SECTIONS = ('tenant', 'db', 'serialize', 'mail')
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = dict.fromkeys(SECTIONS, 0.0)
+        self.depth = dict.fromkeys(SECTIONS, 0)
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds['db'] += time.perf_counter() - started
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block to `section` of the current sampled request, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    # Nested sections of the same request (e.g. recursive serializers) count once
+    metrics.depth[section] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.depth[section] -= 1
+        if metrics.depth[section] == 0:
+            metrics.seconds[section] += time.perf_counter() - started
+
+
+class TimedRepresentationMixin:
+    """Serializer mixin that counts to_representation towards the `serialize` section."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """This process's aggregates, by (view, tenant schema)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.queries = {}
+        self.sections = {}
+
+    def record(self, labels, duration, metrics):
+        with self._lock:
+            self.durations.setdefault(labels, Histogram(DURATION_BUCKETS)).observe(duration)
+            self.queries.setdefault(labels, Histogram(QUERY_BUCKETS)).observe(metrics.queries)
+            totals = self.sections.setdefault(labels, dict.fromkeys(SECTIONS, 0.0))
+            for section, seconds in metrics.seconds.items():
+                totals[section] += seconds
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._render_histogram(lines, 'comments_request_duration_seconds', 'Request latency', self.durations)
+            self._render_histogram(lines, 'comments_request_queries', 'Database queries per request', self.queries)
+            lines.append('# HELP comments_request_section_seconds_total Time spent per request section')
+            lines.append('# TYPE comments_request_section_seconds_total counter')
+            for labels, totals in self.sections.items():
+                for section, seconds in totals.items():
+                    lines.append(f'comments_request_section_seconds_total{{{_labels(labels, section=section)}}} {seconds}')
+        for prefix, lru in (('tenant_cache', tenant_cache), ('token_cache', token_cache)):
+            for name, value in lru.stats().items():
+                lines.append(f'# TYPE {prefix}_{name} gauge')
+                lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in histograms.items():
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{{_labels(labels, le=bound)}}} {count}')
+            lines.append(f'{name}_bucket{{{_labels(labels, le="+Inf")}}} {histogram.count}')
+            lines.append(f'{name}_sum{{{_labels(labels)}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{_labels(labels)}}} {histogram.count}')
+
+
+def _labels(labels, **extra):
+    view, tenant = labels
+    pairs = {'view': view, 'tenant': tenant, **extra}
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in pairs.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def view_label(view_func):
+    # CommentViewSet.replies rather than the route, so a label covers all ids
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', 'unknown')
+    return cls.__name__
+
+
+class RequestMetricsMiddleware:
+    """Place right after the tenant middleware, which sets request.tenant_lookup_seconds."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        metrics.seconds['tenant'] = getattr(request, 'tenant_lookup_seconds', 0.0)
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in settings.DATABASES:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        view = getattr(request, 'metrics_view', 'unresolved')
+        schema = getattr(getattr(request, 'tenant', None), 'schema_name', '')
+        registry.record((view, schema), duration, metrics)
+
+        timings = [f'{section};dur={metrics.seconds[section] * 1000:.2f}' for section in SECTIONS]
+        timings[SECTIONS.index('db')] += f';desc="{metrics.queries} queries"'
+        # total excludes the tenant lookup, which happens before this middleware
+        timings.append(f'total;dur={duration * 1000:.2f}')
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        label = view_label(view_func)
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            label = f'{label}.{actions.get(request.method.lower(), request.method.lower())}'
+        request.metrics_view = label
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition of this process's metrics. Scrapers send
+    METRICS_TOKEN as a bearer token; without one set, only staff sessions get in.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not constant_time_compare(supplied, token):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
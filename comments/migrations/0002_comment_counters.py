@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:25
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    Like = Comment.liked_by.through
+
+    likes = (
+        Like.objects.filter(comment=OuterRef('pk'))
+        .values('comment').annotate(n=Count('*')).values('n')
+    )
+    replies = (
+        Comment.objects.filter(parent=OuterRef('pk'), is_deleted=False)
+        .values('parent').annotate(n=Count('*')).values('n')
+    )
+    Comment.objects.update(
+        likes_count=Coalesce(Subquery(likes, output_field=IntegerField()), Value(0)),
+        replies_count=Coalesce(Subquery(replies, output_field=IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
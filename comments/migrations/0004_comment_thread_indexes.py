@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:26
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build the indexes without locking writes on large tenant schemas
+    atomic = False
+
+    dependencies = [
+        ('comments', '0003_comment_root_keyset_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['thread_id'], name='comment_thread_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('thread_id'), name='text_pattern_ops'), name='comment_thread_upper_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['parent', '-created_at'], name='comment_parent_created_idx'),
+        ),
+    ]
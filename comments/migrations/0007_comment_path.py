@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Walk every tree from its root in one statement; search_path is already
+# set to the tenant schema being migrated.
+BACKFILL_PATHS = """
+WITH RECURSIVE tree (id, path, depth) AS (
+    SELECT id, ''::text, 0 FROM comments_comment WHERE parent_id IS NULL
+    UNION ALL
+    SELECT c.id, tree.path || tree.id || '/', tree.depth + 1
+    FROM comments_comment c JOIN tree ON c.parent_id = tree.id
+)
+UPDATE comments_comment
+SET path = tree.path, depth = tree.depth
+FROM tree
+WHERE comments_comment.id = tree.id AND tree.depth > 0
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0006_notification_digests'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunSQL(BACKFILL_PATHS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='comment_path_idx', opclasses=['text_pattern_ops']),
+        ),
+    ]
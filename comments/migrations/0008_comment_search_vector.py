@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    # Built with the text search configuration of the tenant being migrated
+    Client = apps.get_model('tenants', 'Client')
+    config = (
+        Client.objects.filter(schema_name=schema_editor.connection.schema_name)
+        .values_list('search_config', flat=True)
+        .first()
+    ) or 'english'
+    schema_editor.execute(
+        'ALTER TABLE comments_comment ADD COLUMN search_vector tsvector '
+        'GENERATED ALWAYS AS (to_tsvector(%s::regconfig, text)) STORED',
+        [config],
+    )
+    schema_editor.execute(
+        'CREATE INDEX comment_search_idx ON comments_comment USING gin (search_vector) WHERE NOT is_deleted'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    schema_editor.execute('ALTER TABLE comments_comment DROP COLUMN search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0007_comment_path'),
+        ('tenants', '0002_client_search_config'),
+    ]
+
+    operations = [
+        # The column is not on the Comment model (see comments.search)
+        migrations.RunPython(add_search_vector, drop_search_vector),
+    ]
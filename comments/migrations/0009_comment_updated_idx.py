@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Build the index without locking writes on large tenant schemas
+    atomic = False
+
+    dependencies = [
+        ('comments', '0008_comment_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['updated_at'], name='comment_updated_idx'),
+        ),
+    ]
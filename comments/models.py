@@ -1,4 +1,8 @@
-from django.db import models
+from django.contrib.postgres.indexes import OpClass
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.functions import Upper
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Comment(models.Model):
@@ -6,32 +10,160 @@ class Comment(models.Model):
     text = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
     thread_id = models.TextField(blank=True)  # Manually provided for root comments only
+    # Materialized path: ancestor ids from the root down, each followed by '/'
+    # ('' for roots), so a subtree is one prefix range scan.
+    path = models.TextField(blank=True, default='')
+    depth = models.PositiveIntegerField(default=0)
     liked_by = models.ManyToManyField(User, related_name='liked_comments', blank=True)
 
     is_deleted = models.BooleanField(default=False)
 
+    # Denormalized counters, updated atomically with F() expressions.
+    # Counter updates also bump updated_at, which the read ETags rely on.
+    # Repair drift with `manage.py recount_comments`.
+    likes_count = models.PositiveIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)  # Non-deleted direct replies
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of root comments (comments.pagination)
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(parent__isnull=True),
+                name='comment_root_keyset_idx',
+            ),
+            # Participant lookup and thread_id inheritance
+            models.Index(fields=['thread_id'], name='comment_thread_idx'),
+            # CommentFilter.thread_prefix: istartswith compiles to UPPER(thread_id) LIKE UPPER('...%')
+            models.Index(OpClass(Upper('thread_id'), name='text_pattern_ops'), name='comment_thread_upper_idx'),
+            # Replies of a parent, newest first
+            models.Index(fields=['parent', '-created_at'], name='comment_parent_created_idx'),
+            # Subtree fetch: path LIKE '<prefix>%'
+            models.Index(fields=['path'], opclasses=['text_pattern_ops'], name='comment_path_idx'),
+            # Incremental activity rollups (tenants.rollups): newest write and writes since a watermark
+            models.Index(fields=['updated_at'], name='comment_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        is_new = self._state.adding
         if self.parent:
             # Replies must inherit thread_id from parent
             self.thread_id = self.parent.thread_id
+            self.path = f'{self.parent.path}{self.parent_id}/'
+            self.depth = self.parent.depth + 1
         super().save(*args, **kwargs)
+        if is_new and self.parent_id and not self.is_deleted:
+            Comment.objects.filter(pk=self.parent_id).update(replies_count=F('replies_count') + 1, updated_at=timezone.now())
 
     def __str__(self):
         return f'{self.user.username}: {self.text[:30]}'
 
-    @property
-    def likes_count(self):
-        return self.liked_by.count()
+    def add_like(self, user):
+        """
+        Like as `user`; returns whether the like is new. Concurrent calls for
+        the same user insert one row between them, and only that caller
+        moves the counter.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {Comment.liked_by.through._meta.db_table} (comment_id, user_id) VALUES (%s, %s) '
+                'ON CONFLICT (comment_id, user_id) DO NOTHING RETURNING id',
+                [self.pk, user.pk],
+            )
+            added = cursor.fetchone() is not None
+        if added:
+            Comment.objects.filter(pk=self.pk).update(likes_count=F('likes_count') + 1, updated_at=timezone.now())
+        return added
+
+    def remove_like(self, user):
+        """Take back `user`'s like; returns whether there was one."""
+        removed, _ = Comment.liked_by.through.objects.filter(comment_id=self.pk, user_id=user.pk).delete()
+        if removed:
+            Comment.objects.filter(pk=self.pk).update(likes_count=F('likes_count') - removed, updated_at=timezone.now())
+        return bool(removed)
+
+    def soft_delete(self):
+        """
+        Mark as deleted; returns whether this call did it. Of concurrent calls
+        only the one that flips the row moves the parent's reply counter.
+        """
+        now = timezone.now()
+        deleted = Comment.objects.filter(pk=self.pk, is_deleted=False).update(is_deleted=True, updated_at=now)
+        if deleted:
+            self.is_deleted, self.updated_at = True, now
+            if self.parent_id:
+                Comment.objects.filter(pk=self.parent_id).update(replies_count=F('replies_count') - 1, updated_at=now)
+        return bool(deleted)
 
     def is_reply(self):
         return self.parent is not None
 
+    @property
+    def subtree_path(self):
+        # Path prefix shared by every descendant of this comment
+        return f'{self.path}{self.pk}/'
+
+    def get_descendants(self, max_depth=None):
+        descendants = Comment.objects.filter(path__startswith=self.subtree_path)
+        if max_depth is not None:
+            descendants = descendants.filter(depth__lte=self.depth + max_depth)
+        return descendants
+
+    def get_ancestor_ids(self):
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    def get_ancestors(self):
+        return Comment.objects.filter(pk__in=self.get_ancestor_ids()).order_by('depth')
+
     def __str__(self):
         return f'{self.user.username}: {self.text[:30]}' if not self.is_deleted else '[deleted]'
 
+
+class NotificationPreference(models.Model):
+    class Mode(models.TextChoices):
+        IMMEDIATE = 'immediate'
+        DIGEST = 'digest'
+        OFF = 'off'
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_preference')
+    mode = models.CharField(max_length=10, choices=Mode.choices, default=Mode.IMMEDIATE)
+
+    def __str__(self):
+        return f'{self.user.username}: {self.mode}'
+
+
+class OutboxMessage(models.Model):
+    """An email written in the same transaction as the event that caused it, sent later by `send_notifications`."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        SENT = 'sent'
+        FAILED = 'failed'
+
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    thread_id = models.TextField(blank=True)
+    # Digest rows due in the same window are sent as one message per recipient and thread
+    is_digest = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipient}: {self.subject}'
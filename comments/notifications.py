@@ -0,0 +1,190 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import timed
+from .models import NotificationPreference, OutboxMessage
+
+
+def digest_due_at(now=None):
+    """End of the digest window containing `now`; windows are aligned to the epoch."""
+    window = settings.NOTIFICATION_DIGEST_WINDOW
+    timestamp = (now or timezone.now()).timestamp()
+    return datetime.fromtimestamp((timestamp // window + 1) * window, tz=dt_timezone.utc)
+
+
+def enqueue_mail(recipients, subject, body, thread_id=''):
+    """
+    Queue one message per recipient in the outbox.
+
+    `recipients` are `(email, mode)` pairs, where mode is the recipient's
+    NotificationPreference.Mode (None for users without a preference row).
+    Call this inside the transaction that writes the comment or like, so the
+    notification exists if and only if the event was committed.
+    """
+    enqueue_messages(outbox_messages(recipients, subject, body, thread_id))
+
+
+def enqueue_messages(messages):
+    """Queue OutboxMessages built by outbox_messages, for several threads at once."""
+    with timed('mail'):
+        OutboxMessage.objects.bulk_create(messages)
+
+
+def outbox_messages(recipients, subject, body, thread_id=''):
+    """The unsaved OutboxMessages enqueue_mail would write."""
+    due = digest_due_at()
+    messages = []
+    for email, mode in recipients:
+        mode = mode or settings.NOTIFICATION_DEFAULT_MODE
+        if mode == NotificationPreference.Mode.OFF:
+            continue
+        is_digest = mode == NotificationPreference.Mode.DIGEST
+        messages.append(OutboxMessage(
+            recipient=email,
+            subject=subject,
+            body=body,
+            thread_id=thread_id,
+            is_digest=is_digest,
+            next_attempt_at=due if is_digest else timezone.now(),
+        ))
+    return messages
+
+
+class RateLimiter:
+    """Spaces out sends to at most `rate` messages per second (no limit when falsy)."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.last = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        delay = self.last + self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.last = time.monotonic()
+
+
+def retry_delay(attempts):
+    delay = settings.NOTIFICATION_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.NOTIFICATION_RETRY_MAX_DELAY))
+
+
+def claim_due(batch_size, now=None):
+    """
+    Lease up to `batch_size` due outbox messages of the current schema to the
+    caller and return them.
+
+    The rows are picked with SKIP LOCKED and moved NOTIFICATION_LEASE seconds
+    into the future in one short transaction, so concurrent workers claim
+    different rows without holding locks while they send. Messages of a
+    worker that dies mid-batch become due again when the lease runs out.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .filter(status=OutboxMessage.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'recipient', 'thread_id')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if messages:
+            lease = now + timedelta(seconds=settings.NOTIFICATION_LEASE)
+            OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(next_attempt_at=lease)
+            for message in messages:
+                message.next_attempt_at = lease
+    return messages
+
+
+def deliver_pending(batch_size=None, limiter=None, connection=None):
+    """
+    Send one batch of due outbox messages in the current schema over a single
+    mail connection, one email per immediate message and one per recipient and
+    thread for digest messages. Returns the number of messages processed.
+
+    The batch is claimed (claim_due) and committed before anything is sent;
+    sending, including the limiter's pauses, runs outside any transaction and
+    the results are written in a second short one.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    limiter = limiter or RateLimiter()
+
+    messages = claim_due(batch_size)
+    if not messages:
+        return 0
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        # The relay is unreachable; push the whole batch back.
+        for message in messages:
+            _record_failure(message, exc)
+    else:
+        try:
+            for group in _coalesce(messages):
+                limiter.wait()
+                subject, body = _compose(group)
+                try:
+                    connection.send_messages([EmailMessage(
+                        subject,
+                        body,
+                        settings.DEFAULT_FROM_EMAIL,
+                        [group[0].recipient],
+                        connection=connection,
+                    )])
+                except Exception as exc:
+                    for message in group:
+                        _record_failure(message, exc)
+                else:
+                    sent_at = timezone.now()
+                    for message in group:
+                        message.status = OutboxMessage.Status.SENT
+                        message.attempts += 1
+                        message.sent_at = sent_at
+                        message.last_error = ''
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        OutboxMessage.objects.bulk_update(
+            messages, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'],
+        )
+    return len(messages)
+
+
+def _record_failure(message, exc):
+    message.attempts += 1
+    message.last_error = repr(exc)
+    if message.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+        message.status = OutboxMessage.Status.FAILED
+    else:
+        message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
+
+
+def _coalesce(messages):
+    def key(message):
+        return message.recipient, message.thread_id
+
+    for message in messages:
+        if not message.is_digest:
+            yield [message]
+    digests = sorted((message for message in messages if message.is_digest), key=key)
+    for _, group in groupby(digests, key=key):
+        yield list(group)
+
+
+def _compose(group):
+    if len(group) == 1:
+        return group[0].subject, group[0].body
+    thread_id = group[0].thread_id
+    subject = f"{len(group)} new notifications in thread {thread_id}"
+    body = "\n\n---\n\n".join(f"{message.subject}\n\n{message.body}" for message in group)
+    return subject, body
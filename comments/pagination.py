@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+
+
+class CommentCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (created_at, id), newest first.
+
+    DRF's CursorPagination keys on the first ordering field only and falls
+    back to OFFSET for ties. Here the cursor carries both columns, and
+    keyset_filter bounds created_at so every page is an index range scan
+    starting at the cursor, no matter how deep the client pages.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.COMMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.COMMENTS_MAX_PAGE_SIZE
+
+    @staticmethod
+    def keyset_filter(queryset, created_at, pk, reverse=False):
+        """Rows after (created_at, pk) in the listing order, or before them when `reverse`."""
+        # The redundant created_at bound is what Postgres can start the index
+        # scan from; the OR alone is only a filter applied to every row walked
+        if reverse:
+            return queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk),
+                created_at__gte=created_at,
+            )
+        return queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+            created_at__lte=created_at,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        current_position = self.cursor.position if self.cursor is not None else None
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            created_at, pk = self._parse_position(current_position)
+            queryset = self.keyset_filter(queryset, created_at, pk, reverse)
+
+        # Fetch one extra row to know whether another page follows.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None
+
+        if self.page:
+            self.next_position = self._get_position_from_instance(self.page[-1], self.ordering)
+            self.previous_position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            # Empty page: step back over the cursor we came from.
+            self.next_position = self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    def get_link_after(self, base_url, instance):
+        """Link to the page that follows `instance`, for continuations outside a paginated response."""
+        self.base_url = base_url
+        position = self._get_position_from_instance(instance, self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        return f'{instance.created_at.isoformat()}|{instance.pk}'
+
+    def _parse_position(self, position):
+        created_at, _, pk = position.rpartition('|')
+        try:
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+
+class CommentSearchPagination(PageNumberPagination):
+    """Numbered pages for search results, which are ordered by rank rather than by time."""
+    page_size = settings.COMMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.COMMENTS_MAX_PAGE_SIZE
+
+
+class LikerPagination(CursorPagination):
+    """Likes of one comment, newest first; the like's id is unique, so DRF's cursor needs no offset."""
+    ordering = '-id'
+    page_size = settings.COMMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.COMMENTS_MAX_PAGE_SIZE
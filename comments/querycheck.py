@@ -0,0 +1,145 @@
+"""
+N+1 and query budget checks per request (QUERY_INSPECTION).
+
+QueryInspectionMiddleware records every statement a view runs, grouped by
+shape: the SQL with its literals and IN lists collapsed, so the query a
+serializer field issues for each row shows up as one shape run many times.
+A shape run QUERY_REPEAT_THRESHOLD times or more is reported with where it
+came from, the serializer field when there is one.
+
+A view caps its queries per action with a `query_budgets` dict, e.g.
+``query_budgets = {'list': 6}``; other actions get QUERY_BUDGET_DEFAULT.
+The count starts at the view, so the tenant lookup is not included, and
+leaves out the `SET search_path` django_tenants issues ahead of each
+statement (is_schema_switch), which would double every count and look like
+an N+1 of its own.
+
+With QUERY_INSPECTION = 'log' (the default outside tests) problems of
+QUERY_INSPECTION_SAMPLE_RATE of requests are logged as warnings; with
+'raise' (the default under `manage.py test`) every request is checked and
+fails with QueryBudgetExceeded, which fails the test.
+"""
+import logging
+import random
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.fields import Field
+
+from .metrics import view_label
+
+logger = logging.getLogger(__name__)
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)', re.IGNORECASE)
+SCHEMA_SWITCH = re.compile(r'\s*SET search_path\b', re.IGNORECASE)
+# Only frames of this project (not Django or DRF) count as the caller of a query
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def normalize(sql):
+    """The shape of a statement: literals become ? and IN lists of any length look alike."""
+    shape = LITERALS.sub('?', sql)
+    shape = PLACEHOLDER_LISTS.sub('IN (...)', shape)
+    return ' '.join(shape.split())
+
+
+def is_schema_switch(sql):
+    """Whether `sql` is the search_path the tenant backend sets on every cursor."""
+    return SCHEMA_SWITCH.match(sql) is not None
+
+
+def find_origin():
+    """The serializer field, or else the project code, that issued the current query."""
+    frame = sys._getframe(2)
+    caller = None
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, Field) and owner.field_name:
+            return f'{type(owner.parent).__name__}.{owner.field_name}'
+        filename = frame.f_code.co_filename
+        if caller is None and filename.startswith(PROJECT_ROOT) and filename != __file__:
+            caller = f'{Path(filename).relative_to(PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return caller or 'unknown'
+
+
+class QueryLog:
+    """execute_wrapper that counts statements by shape."""
+
+    def __init__(self):
+        self.shapes = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if is_schema_switch(sql):
+            return execute(sql, params, many, context)
+        shape = normalize(sql)
+        self.shapes[shape] += 1
+        # Only repeated shapes can be N+1s; spare the stack walk for the rest
+        if self.shapes[shape] == 2:
+            self.origins[shape] = find_origin()
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(self.shapes.values())
+
+    def repeated(self, threshold):
+        return [(shape, runs, self.origins[shape]) for shape, runs in self.shapes.most_common() if runs >= threshold]
+
+
+def get_budget(view_func, action):
+    budgets = getattr(getattr(view_func, 'cls', None), 'query_budgets', {})
+    return budgets.get(action, settings.QUERY_BUDGET_DEFAULT)
+
+
+class QueryInspectionMiddleware:
+    """Place last in MIDDLEWARE so only the view and its response rendering are counted."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = settings.QUERY_INSPECTION
+        if mode == 'off' or (mode == 'log' and random.random() >= settings.QUERY_INSPECTION_SAMPLE_RATE):
+            return self.get_response(request)
+        log = QueryLog()
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(log))
+            # Includes rendering, where DRF responses are serialized
+            response = self.get_response(request)
+        if hasattr(request, 'query_budget'):
+            self.check(request, log)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if settings.QUERY_INSPECTION == 'off':
+            return
+        action = getattr(view_func, 'actions', {}).get(request.method.lower())
+        request.query_label = view_label(view_func) + (f'.{action}' if action else '')
+        request.query_budget = get_budget(view_func, action)
+
+    def check(self, request, log):
+        problems = [
+            f'{runs} x {shape} (from {origin})'
+            for shape, runs, origin in log.repeated(settings.QUERY_REPEAT_THRESHOLD)
+        ]
+        if log.count > request.query_budget:
+            problems.insert(0, f'{log.count} queries, budget {request.query_budget}')
+        if not problems:
+            return
+        message = f'{request.method} {request.path} ({request.query_label}): ' + '; '.join(problems)
+        if settings.QUERY_INSPECTION == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
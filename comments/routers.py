@@ -0,0 +1,110 @@
+"""
+Read replicas for comment reads.
+
+DATABASE_REPLICAS are aliases of read-only copies of the default database
+(DATABASE_REPLICA_URLS). ReplicaRouter sends nothing to them unless a view
+opts in: ReplicaReadsMixin runs the view's `replica_actions` inside
+use_replica(), which points a replica connection at the request's tenant
+schema and routes that request's reads to it. Writes always go to default.
+
+A client that has just written is pinned to default for
+REPLICA_STICKY_SECONDS, so it reads its own writes despite replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+_read_alias = ContextVar('replica_read_alias', default=None)
+
+
+class ReplicaRouter:
+    """Put before django_tenants' TenantSyncRouter in DATABASE_ROUTERS."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from a replica, which would otherwise be saved there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def reading_from_replica():
+    return _read_alias.get() is not None
+
+
+@contextmanager
+def use_replica():
+    """Route the reads in the block to a replica, in the schema of the default connection."""
+    if not settings.DATABASE_REPLICAS:
+        yield DEFAULT_DB_ALIAS
+        return
+    alias = random.choice(settings.DATABASE_REPLICAS)
+    # Switching schemas only sets search_path on the connection's next query
+    if getattr(connection, 'tenant', None) is not None:
+        connections[alias].set_tenant(connection.tenant)
+    else:
+        connections[alias].set_schema(connection.schema_name)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def _pin_key(request):
+    if request.user.is_authenticated:
+        return f'replica_pin:user:{request.user.pk}'
+    return f'replica_pin:ip:{request.META.get("REMOTE_ADDR")}'
+
+
+def pin_to_primary(request):
+    cache.set(_pin_key(request), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(request):
+    return cache.get(_pin_key(request), False)
+
+
+class ReplicaReadsMixin:
+    """
+    DRF view mixin: `replica_actions` read from a replica unless the client
+    wrote recently; successful writes through the view pin the client.
+    Pinned clients also bypass the thread cache (`replica_pinned`), which
+    may still hold what a lagging replica returned before their write.
+    """
+    replica_actions = ()
+    replica_pinned = False
+
+    def initial(self, request, *args, **kwargs):
+        # After authentication, so pins can be per user
+        super().initial(request, *args, **kwargs)
+        if settings.DATABASE_REPLICAS and self.action in self.replica_actions:
+            self.replica_pinned = is_pinned(request)
+            if not self.replica_pinned:
+                self._replica = use_replica()
+                self._replica.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica = getattr(self, '_replica', None)
+        if replica is not None:
+            self._replica = None
+            replica.__exit__(None, None, None)
+        elif settings.DATABASE_REPLICAS and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            pin_to_primary(request)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,122 @@
+"""
+Full-text search over comment text.
+
+Each tenant schema has a stored generated column
+
+    comments_comment.search_vector = to_tsvector(<config>, text)
+
+with a GIN index over non-deleted rows. <config> is the tenant's
+Client.search_config; the column is created by migration 0008 and rebuilt
+by `set_search_config`. The column is left out of the Comment model so
+ordinary reads never load it.
+
+The `search` query parameter accepts words (all must match), "quoted
+phrases" and prefix* terms.
+"""
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVectorField
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from .models import Comment
+
+TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+
+SEARCH_VECTOR = RawSQL('"comments_comment"."search_vector"', [], output_field=SearchVectorField())
+
+
+def get_search_config(request):
+    return request.tenant.search_config
+
+
+def parse_search(text, config):
+    """Turn user input into a SearchQuery, or None when there is nothing to search for."""
+    query = None
+    for phrase, word in TOKEN.findall(text):
+        if phrase.strip():
+            term = SearchQuery(phrase, search_type='phrase', config=config)
+        elif word.endswith('*') and word.strip('*'):
+            # Quote the lexeme so operator characters in it are taken literally
+            lexeme = word.rstrip('*').replace('\\', '\\\\').replace("'", "''")
+            term = SearchQuery(f"'{lexeme}':*", search_type='raw', config=config)
+        elif word.strip('*"'):
+            term = SearchQuery(word, search_type='plain', config=config)
+        else:
+            continue
+        query = term if query is None else query & term
+    return query
+
+
+def search_comments(queryset, text, config):
+    """Non-deleted comments of `queryset` matching `text`, best match first."""
+    query = parse_search(text, config)
+    if query is None:
+        return queryset
+    return (
+        queryset
+        .filter(is_deleted=False)
+        .alias(search_vector=SEARCH_VECTOR)
+        .filter(search_vector=query)
+        .alias(search_rank=SearchRank(SEARCH_VECTOR, query))
+        .order_by('-search_rank', '-id')
+    )
+
+
+def attach_headlines(comments, text, config):
+    """Set `headline`, the text with matches wrapped in <mark>, on a page of search results."""
+    query = parse_search(text, config)
+    if query is None or not comments:
+        return
+    headlines = dict(
+        Comment.objects.filter(pk__in=[comment.pk for comment in comments])
+        .annotate(headline=SearchHeadline('text', query, config=config, start_sel='<mark>', stop_sel='</mark>'))
+        .values_list('pk', 'headline')
+    )
+    for comment in comments:
+        comment.headline = headlines.get(comment.pk)
+
+
+def set_search_config(config):
+    """
+    Rebuild the current schema's search column for another text search
+    configuration. This rewrites the table, so run it off-peak on big tenants.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Fails with an error for configurations the server does not know
+        cursor.execute('SELECT %s::regconfig', [config])
+        cursor.execute('ALTER TABLE comments_comment DROP COLUMN IF EXISTS search_vector')
+        cursor.execute(
+            'ALTER TABLE comments_comment ADD COLUMN search_vector tsvector '
+            'GENERATED ALWAYS AS (to_tsvector(%s::regconfig, text)) STORED',
+            [config],
+        )
+        cursor.execute(
+            'CREATE INDEX comment_search_idx ON comments_comment USING gin (search_vector) WHERE NOT is_deleted'
+        )
+
+
+class CommentSearchFilter(BaseFilterBackend):
+    """Drop-in replacement for SearchFilter on CommentViewSet, backed by the tsvector column."""
+    search_param = api_settings.SEARCH_PARAM
+
+    @classmethod
+    def get_search_text(cls, request):
+        return request.query_params.get(cls.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        text = self.get_search_text(request)
+        if not text:
+            return queryset
+        return search_comments(queryset, text, get_search_config(request))
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Full-text search: words, "quoted phrases" and prefix* terms; best matches first.',
+            'schema': {'type': 'string'},
+        }]
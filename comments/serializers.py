@@ -1,5 +1,15 @@
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Comment
+from rest_framework.utils.urls import replace_query_param
+
+from .metrics import TimedRepresentationMixin
+from .models import Comment, NotificationPreference
+from .pagination import CommentCursorPagination
 
 class CommentCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -35,39 +45,166 @@ class CommentCreateSerializer(serializers.ModelSerializer):
         return Comment.objects.create(user=user, **validated_data)
 
 
+class BulkCommentListSerializer(serializers.ListSerializer):
+    """
+    Validates a whole batch before anything is written, then inserts it with
+    one bulk_create.
+
+    Existing parents are loaded in one query. Ids for the new rows are
+    reserved from the table's sequence up front, so thread_id, path and depth
+    of replies to other comments of the batch are resolved in memory too.
+    """
+
+    def validate(self, attrs):
+        refs = {}
+        for index, item in enumerate(attrs):
+            parent_ref = item.get('parent_ref')
+            if parent_ref is not None and parent_ref not in refs:
+                raise serializers.ValidationError(
+                    f'Item {index}: parent_ref {parent_ref!r} does not name an earlier comment of the batch.'
+                )
+            ref = item.get('ref')
+            if ref is not None:
+                if ref in refs:
+                    raise serializers.ValidationError(f'Item {index}: ref {ref!r} is used twice.')
+                refs[ref] = index
+
+        parent_ids = {item['parent'] for item in attrs if item.get('parent') is not None}
+        parents = Comment.objects.in_bulk(parent_ids)
+        missing = parent_ids - parents.keys()
+        if missing:
+            raise serializers.ValidationError(f'Unknown parent comment(s): {sorted(missing)}.')
+        self.parents = parents
+        return attrs
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('comments_comment', 'id')) FROM generate_series(1, %s)",
+                [len(validated_data)],
+            )
+            ids = [pk for pk, in cursor.fetchall()]
+
+        now = timezone.now()
+        comments = []
+        by_ref = {}
+        for pk, item in zip(ids, validated_data):
+            if item.get('parent_ref') is not None:
+                parent = by_ref[item['parent_ref']]
+            else:
+                parent = self.parents.get(item.get('parent'))
+            comment = Comment(pk=pk, user=user, text=item['text'], created_at=now, updated_at=now)
+            if parent is not None:
+                # Same inheritance as Comment.save
+                comment.parent = parent
+                comment.thread_id = parent.thread_id
+                comment.path = f'{parent.path}{parent.pk}/'
+                comment.depth = parent.depth + 1
+                if parent._state.adding:
+                    parent.replies_count += 1
+            else:
+                comment.thread_id = item['thread_id']
+            if item.get('ref') is not None:
+                by_ref[item['ref']] = comment
+            comments.append(comment)
+
+        Comment.objects.bulk_create(comments)
+        for comment in comments:
+            comment._state.adding = False
+
+        # Replies to comments that already existed bump their counters, one UPDATE for all
+        added = Counter(comment.parent_id for comment in comments if comment.parent_id in self.parents)
+        if added:
+            Comment.objects.filter(pk__in=added).update(
+                replies_count=F('replies_count') + Case(
+                    *[When(pk=pk, then=Value(n)) for pk, n in added.items()],
+                    output_field=IntegerField(),
+                ),
+                updated_at=now,
+            )
+        return comments
+
+
+class BulkCommentCreateSerializer(CommentCreateSerializer):
+    """
+    One item of POST /api/comments/bulk/. Besides `parent`, a reply may name
+    an earlier item of the same batch through `parent_ref`, matching that
+    item's `ref`.
+    """
+    parent = serializers.IntegerField(required=False, allow_null=True)
+    ref = serializers.CharField(required=False, max_length=64, write_only=True)
+    parent_ref = serializers.CharField(required=False, max_length=64, write_only=True)
+
+    class Meta(CommentCreateSerializer.Meta):
+        fields = CommentCreateSerializer.Meta.fields + ['ref', 'parent_ref']
+        list_serializer_class = BulkCommentListSerializer
+
+    def validate(self, data):
+        if data.get('parent') is not None and data.get('parent_ref') is not None:
+            raise serializers.ValidationError({'parent_ref': 'Give either parent or parent_ref, not both.'})
+        # A parent_ref makes a reply just like parent does
+        super().validate({**data, 'parent': data.get('parent') or data.get('parent_ref')})
+        return data
+
+
 class RecursiveField(serializers.Serializer):
     def to_representation(self, value):
         serializer = self.parent.parent.__class__(value, context=self.context)
         return serializer.data
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()
     replies = RecursiveField(many=True, read_only=True)
     likes_count = serializers.IntegerField(read_only=True)
-    liked_by = serializers.StringRelatedField(many=True, read_only=True)
+    # Per user: False here, filled in for the requesting user by conditional.mark_liked_by_me
+    liked_by_me = serializers.ReadOnlyField(default=False)
     text = serializers.SerializerMethodField()
+    # Set when ?max_depth= / ?max_children= cut this node's replies
+    has_more = serializers.SerializerMethodField()
+    next = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'text', 'thread_id', 'parent', 'created_at', 'likes_count', 'replies', 'is_deleted', 'liked_by']
-        read_only_fields = ['user', 'likes_count', 'created_at', 'replies', 'liked_by']
+        fields = ['id', 'user', 'text', 'thread_id', 'parent', 'depth', 'created_at', 'likes_count', 'liked_by_me', 'replies', 'is_deleted', 'has_more', 'next']
+        read_only_fields = ['user', 'depth', 'likes_count', 'created_at', 'replies']
 
     def get_text(self, obj):
         if obj.is_deleted:
             return "This comment has been deleted."
         return obj.text
 
+    def get_has_more(self, obj):
+        return getattr(obj, 'has_more', False)
 
-class CommentListSerializer(serializers.ModelSerializer):
+    def get_next(self, obj):
+        # Continuation link to the remaining replies, keeping the request's limits
+        request = self.context.get('request')
+        if not self.get_has_more(obj) or request is None:
+            return None
+        url = request.build_absolute_uri(reverse('comment-replies', kwargs={'pk': obj.pk}))
+        for param in ('max_depth', 'max_children'):
+            if param in request.query_params:
+                url = replace_query_param(url, param, request.query_params[param])
+        if obj.last_shown_reply is not None:
+            url = CommentCursorPagination().get_link_after(url, obj.last_shown_reply)
+        return url
+
+
+class CommentListSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField()
     likes_count = serializers.IntegerField(read_only=True)
-    replies_count = serializers.SerializerMethodField()
+    replies_count = serializers.IntegerField(read_only=True)
+    # Per user: False here, filled in for the requesting user by conditional.mark_liked_by_me
+    liked_by_me = serializers.ReadOnlyField(default=False)
     text = serializers.SerializerMethodField()
+    # Text with the matches in <mark>, on ?search= results only
+    headline = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'text', 'thread_id', 'parent', 'created_at', 'likes_count', 'replies_count', 'is_deleted']
+        fields = ['id', 'user', 'text', 'thread_id', 'parent', 'created_at', 'likes_count', 'liked_by_me', 'replies_count', 'is_deleted', 'headline']
         read_only_fields = ['user', 'likes_count', 'created_at', 'replies_count']
 
     def get_text(self, obj):
@@ -75,8 +212,8 @@ class CommentListSerializer(serializers.ModelSerializer):
             return "This comment has been deleted."
         return obj.text
 
-    def get_replies_count(self, obj):
-        return obj.replies.count()
+    def get_headline(self, obj):
+        return getattr(obj, 'headline', None)
     
 
 class CommentUpdateSerializer(serializers.ModelSerializer):
@@ -86,5 +223,22 @@ class CommentUpdateSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         instance.text = validated_data['text']
-        instance.save()
-        return instance
\ No newline at end of file
+        # Only write the edited columns so concurrent counter updates survive
+        instance.save(update_fields=['text', 'updated_at'])
+        return instance
+
+
+class LikerSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='user_id')
+    username = serializers.CharField(source='user.username')
+
+
+class ReplyTreeQuerySerializer(serializers.Serializer):
+    max_depth = serializers.IntegerField(min_value=0, required=False, help_text='Reply levels to expand below the top')
+    max_children = serializers.IntegerField(min_value=1, required=False, help_text='Replies to show per comment')
+
+
+class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificationPreference
+        fields = ['mode']
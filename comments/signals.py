@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from comments.authentication import forget_token, forget_user
+from comments.cache import invalidate_comment
+from comments.models import Comment
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_thread_cache(sender, instance, **kwargs):
+    # Creates, edits and soft deletes from the API and the admin all pass through save()
+    invalidate_comment(instance)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user_tokens(sender, instance, **kwargs):
+    # Deactivation, renames and deletion must reach authenticated requests
+    forget_user(instance.pk)
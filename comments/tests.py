@@ -1,3 +1,728 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+from contextlib import contextmanager
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db import connection, connections
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
+from django_tenants.utils import schema_context
+from rest_framework.authtoken.models import Token
+
+from tenants.cache import tenant_cache
+from tenants.models import Client, Domain
+
+from . import benchmark, events
+from . import cache as thread_cache
+from .authentication import create_token, token_cache
+from .models import Comment, NotificationPreference, OutboxMessage
+from .notifications import RateLimiter, claim_due, deliver_pending, enqueue_mail
+from .querycheck import QueryLog, is_schema_switch, normalize
+from .throttling import TokenBucket, validate_throttle_rates
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+        'KEY_FUNCTION': 'django_tenants.cache.make_key',
+        'REVERSE_KEY_FUNCTION': 'django_tenants.cache.reverse_key',
+    }
+}
+
+
+class APITestCase(TenantTestCase):
+    """Requests through the full middleware stack to the test tenant's domain."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # TenantTestCase skips SimpleTestCase.setUpClass, which applies class-level override_settings
+        if cls._overridden_settings:
+            cls.enterClassContext(override_settings(**cls._overridden_settings))
+
+    def setUp(self):
+        # Thread cache entries, throttle buckets and replica pins of earlier tests
+        caches['default'].clear()
+        tenant_cache.clear()
+        self.client = TenantClient(self.tenant)
+
+    def login(self, username):
+        """A user of the test tenant and a client sending their API token."""
+        user = User.objects.create_user(username, f'{username}@example.com')
+        token = Token.objects.create(user=user)
+        return user, TenantClient(self.tenant, HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+def build_thread(users, thread_id, width=0, depth=0):
+    """
+    A root with `width` direct replies, each liked by every user and answered
+    once, and a chain of `depth` nested replies below the first of them.
+    Returns the root and the deepest comment.
+    """
+    root = Comment.objects.create(user=users[0], text=f'Root of {thread_id} on energy', thread_id=thread_id)
+    replies = [Comment.objects.create(user=users[i % len(users)], text=f'Reply {i}', parent=root) for i in range(width)]
+    for reply in replies:
+        Comment.objects.create(user=users[-1], text='Answer', parent=reply)
+        for user in users:
+            reply.add_like(user)
+    deepest = replies[0] if replies else root
+    for i in range(depth):
+        deepest = Comment.objects.create(user=users[i % len(users)], text=f'Nested {i}', parent=deepest)
+    return root, deepest
+
+
+@override_settings(CACHES=LOCMEM_CACHES, THREAD_CACHE_ALIAS='default')
+class ThreadCacheIsolationTests(SimpleTestCase):
+    """Two tenants using the same thread ids, scopes and URLs never see each other's entries."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(connection.set_schema_to_public)
+
+    def store(self, schema_name, data):
+        connection.set_schema(schema_name)
+        key = thread_cache.entry_key(thread_cache.thread_scope('chart-1'), 'retrieve|json|/api/comments/1/')
+        thread_cache.set_entry(key, {'data': data, 'etag': 'e', 'last_modified': None})
+        return key
+
+    def lookup(self, schema_name):
+        connection.set_schema(schema_name)
+        key = thread_cache.entry_key(thread_cache.thread_scope('chart-1'), 'retrieve|json|/api/comments/1/')
+        return thread_cache.get_entry(key)
+
+    def test_entries_are_per_schema(self):
+        self.store('tenant_a', 'a')
+        self.assertIsNone(self.lookup('tenant_b'))
+        self.store('tenant_b', 'b')
+        self.assertEqual(self.lookup('tenant_a')['data'], 'a')
+        self.assertEqual(self.lookup('tenant_b')['data'], 'b')
+
+    def test_key_of_another_schema_misses(self):
+        # Even a key computed for tenant_a is looked up under tenant_b's prefix
+        key = self.store('tenant_a', 'a')
+        connection.set_schema('tenant_b')
+        self.assertIsNone(thread_cache.get_entry(key))
+        self.assertIsNone(cache.get(key))
+
+    def test_invalidation_is_per_schema(self):
+        self.store('tenant_a', 'a')
+        self.store('tenant_b', 'b')
+        # As on commit of a write, which runs in the writer's schema
+        connection.set_schema('tenant_a')
+        thread_cache.invalidate([thread_cache.thread_scope('chart-1')], 'tenant_a')
+        self.assertIsNone(self.lookup('tenant_a'))
+        self.assertEqual(self.lookup('tenant_b')['data'], 'b')
+
+    def test_stats_are_per_schema(self):
+        self.lookup('tenant_a')
+        self.lookup('tenant_a')
+        self.assertEqual(thread_cache.get_stats('tenant_a')['misses'], 2)
+        self.assertEqual(thread_cache.get_stats('tenant_b')['misses'], 0)
+
+
+class ThreadCacheTenantTests(APITestCase):
+    """A second tenant with the same comment ids, thread ids and URLs is served its own rows, never cached ones."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connection.set_schema_to_public()
+        cls.other = Client(schema_name='other', name='Other')
+        cls.other.save(verbosity=0)
+        cls.other_domain = Domain.objects.create(tenant=cls.other, domain='other.test.com')
+        settings.ALLOWED_HOSTS += ['other.test.com']
+        connection.set_tenant(cls.tenant)
+
+    @classmethod
+    def tearDownClass(cls):
+        settings.ALLOWED_HOSTS.remove('other.test.com')
+        connection.set_schema_to_public()
+        cls.other_domain.delete()
+        cls.other.delete(force_drop=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.other_client = TenantClient(self.other)
+        self.addCleanup(connection.set_tenant, self.tenant)
+        for tenant, text in ((self.tenant, 'Mine'), (self.other, 'Theirs')):
+            connection.set_tenant(tenant)
+            user = User.objects.create_user('ann', 'ann@example.com')
+            Comment.objects.create(pk=1001, user=user, text=text, thread_id='chart-1')
+
+    def get_texts(self, client):
+        return (
+            client.get('/api/comments/1001/').json()['text'],
+            client.get('/api/comments/thread/chart-1/tree/').json()[0]['text'],
+            client.get('/api/comments/').json()['results'][0]['text'],
+        )
+
+    def test_tenants_never_read_each_others_entries(self):
+        self.assertEqual(self.get_texts(self.client), ('Mine',) * 3)
+        # Same URLs, now cached for the first tenant
+        self.assertEqual(self.get_texts(self.other_client), ('Theirs',) * 3)
+        self.assertEqual(self.get_texts(self.client), ('Mine',) * 3)
+        # Counters are read in their tenant's schema, as thread_cache_stats does
+        for schema_name, hits in (('test', 3), ('other', 0)):
+            with schema_context(schema_name):
+                self.assertEqual(thread_cache.get_stats(schema_name)['hits'], hits)
+
+    def test_writes_invalidate_only_their_tenant(self):
+        self.get_texts(self.client)
+        self.get_texts(self.other_client)
+        connection.set_tenant(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.get(pk=1001)
+            comment.text = 'Edited'
+            comment.save()
+        self.assertEqual(self.get_texts(self.other_client), ('Edited',) * 3)
+        self.assertEqual(self.get_texts(self.client), ('Mine',) * 3)
+
+
+class RecordingConnection:
+    """Mail connection that keeps what it sends and how deep in transactions it was sent."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.fail:
+            raise ConnectionError('relay down')
+        self.sent += [(message, len(connection.savepoint_ids)) for message in messages]
+        return len(messages)
+
+
+class OutboxDeliveryTests(TenantTestCase):
+    """The outbox drains through Django's locmem email backend, which the test runner installs."""
+
+    def drain(self, **kwargs):
+        return deliver_pending(limiter=RateLimiter(), **kwargs)
+
+    def test_immediate_messages_are_sent_once(self):
+        enqueue_mail([('a@example.com', None), ('b@example.com', None)], 'New comment', 'Hello', thread_id='t')
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['a@example.com', 'b@example.com'])
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.Status.SENT).count(), 2)
+        self.assertEqual(self.drain(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_mail_is_sent_outside_the_claiming_transaction(self):
+        enqueue_mail([('a@example.com', None)], 'New comment', 'Hello')
+        depth = len(connection.savepoint_ids)
+        relay = RecordingConnection()
+        self.drain(connection=relay)
+        (message, depth_when_sent), = relay.sent
+        self.assertEqual(message.to, ['a@example.com'])
+        self.assertEqual(depth_when_sent, depth)
+
+    def test_claimed_messages_are_leased(self):
+        enqueue_mail([('a@example.com', None)], 'New comment', 'Hello')
+        self.assertEqual(len(claim_due(10)), 1)
+        # Another worker finds nothing to do until the lease runs out
+        self.assertEqual(claim_due(10), [])
+        expired = timezone.now() + timedelta(seconds=settings.NOTIFICATION_LEASE + 1)
+        self.assertEqual(len(claim_due(10, now=expired)), 1)
+
+    def test_failed_send_is_retried_later(self):
+        enqueue_mail([('a@example.com', None)], 'New comment', 'Hello')
+        self.assertEqual(self.drain(connection=RecordingConnection(fail=True)), 1)
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.Status.PENDING, 1))
+        self.assertGreater(message.next_attempt_at, timezone.now())
+        self.assertLess(message.next_attempt_at, timezone.now() + timedelta(seconds=settings.NOTIFICATION_LEASE))
+        self.assertIn('relay down', message.last_error)
+        # Not due yet
+        self.assertEqual(self.drain(), 0)
+
+
+class NotificationDigestTests(TenantTestCase):
+    def drain(self):
+        return deliver_pending(limiter=RateLimiter())
+
+    def test_preferences(self):
+        enqueue_mail(
+            [('off@example.com', NotificationPreference.Mode.OFF), ('digest@example.com', NotificationPreference.Mode.DIGEST)],
+            'New comment', 'Hello', thread_id='t',
+        )
+        self.assertFalse(OutboxMessage.objects.filter(recipient='off@example.com').exists())
+        # Digest rows wait for the end of their window
+        self.assertEqual(self.drain(), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_digests_are_coalesced_per_recipient_and_thread(self):
+        for subject, thread_id in (('First', 't'), ('Second', 't'), ('Elsewhere', 'u')):
+            enqueue_mail([('d@example.com', NotificationPreference.Mode.DIGEST)], subject, 'Body', thread_id=thread_id)
+        OutboxMessage.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.drain(), 3)
+        self.assertEqual(len(mail.outbox), 2)
+        digest, = [message for message in mail.outbox if 'First' in message.body]
+        self.assertIn('Second', digest.body)
+        self.assertEqual(digest.subject, '2 new notifications in thread t')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket('throttle:test:user:1', capacity=3, refill_rate=1.0)
+        self.assertEqual([bucket.take(now=100)[0] for _ in range(4)], [True, True, True, False])
+        self.assertTrue(bucket.take(now=101)[0])
+        self.assertFalse(bucket.take(now=101)[0])
+
+    def test_denied_requests_spend_nothing(self):
+        bucket = TokenBucket('throttle:test:user:2', capacity=1, refill_rate=1.0)
+        bucket.take(now=100)
+        for _ in range(10):
+            bucket.take(now=100)
+        self.assertTrue(bucket.take(now=101)[0])
+
+    def test_idle_bucket_holds_at_most_capacity(self):
+        bucket = TokenBucket('throttle:test:user:3', capacity=2, refill_rate=1.0)
+        bucket.take(now=100)
+        self.assertEqual([bucket.take(now=1000)[0] for _ in range(3)], [True, True, False])
+
+    def test_cost_above_capacity_passes_on_full_bucket_and_leaves_debt(self):
+        bucket = TokenBucket('throttle:test:user:4', capacity=10, refill_rate=1.0)
+        self.assertTrue(bucket.take(cost=30, now=100)[0])
+        allowed, _, retry_after = bucket.take(now=110)
+        self.assertFalse(allowed)
+        self.assertEqual(retry_after, 11)
+        self.assertTrue(bucket.take(now=121)[0])
+
+    def test_rate_validation(self):
+        validate_throttle_rates({'comment_write': '10/minute', 'like': None})
+        for rates in ({'like': 'often'}, {'like': '0/minute'}, ['10/minute']):
+            with self.assertRaises(ValidationError):
+                validate_throttle_rates(rates)
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        Client.objects.filter(pk=self.tenant.pk).update(throttle_rates={'comment_write': '3/minute'})
+        self.user, self.client = self.login('ann')
+
+    def post(self, path, data):
+        return self.client.post(path, data, content_type='application/json')
+
+    def test_bulk_is_charged_per_comment(self):
+        response = self.post('/api/comments/bulk/', [{'text': f'Item {i}', 'thread_id': 't'} for i in range(5)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['RateLimit-Limit'], '3')
+        self.assertEqual(response['RateLimit-Remaining'], '0')
+        # Two tokens of debt, then one for this request, at one token per 20 seconds
+        response = self.post('/api/comments/', {'text': 'One more', 'thread_id': 't'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+
+class QueryShapeTests(SimpleTestCase):
+    def test_literals_and_in_lists_collapse(self):
+        self.assertEqual(
+            normalize("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' AND n = 5"),
+            normalize("SELECT * FROM t WHERE id IN (%s) AND name = 'y' AND n = 7"),
+        )
+
+    def test_repeated_shape_is_reported(self):
+        log = QueryLog()
+        for pk in range(6):
+            log(lambda *args: None, 'SET search_path = \'test\',\'public\'', None, False, {})
+            log(lambda *args: None, f'SELECT * FROM auth_user WHERE id = {pk}', None, False, {})
+        log(lambda *args: None, 'SELECT 1', None, False, {})
+        (shape, runs, _), = log.repeated(5)
+        self.assertEqual((shape, runs), ('SELECT * FROM auth_user WHERE id = ?', 6))
+        # The tenant backend's search_path before every statement is not counted
+        self.assertEqual(log.count, 7)
+
+
+class ThreadReadQueryTests(APITestCase):
+    """Tree reads run the same statements for a thread of 3 comments as for one of 81."""
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = self.login('ann')
+        users = [self.user] + [User.objects.create_user(f'user{i}') for i in range(3)]
+        self.small, _ = build_thread(users, 'chart-small', width=1)
+        self.large, _ = build_thread(users, 'chart-large', width=30, depth=20)
+
+    @contextmanager
+    def assertNumStatements(self, num):
+        """assertNumQueries, not counting the search_path django-tenants sets."""
+        with CaptureQueriesContext(connection) as context:
+            yield
+        statements = [query['sql'] for query in context.captured_queries if not is_schema_switch(query['sql'])]
+        self.assertEqual(len(statements), num, '\n'.join(statements))
+
+    def test_queries_do_not_grow_with_the_thread(self):
+        for path, num in (
+            # Domain and tenant, token, validators, comments and liked_by_me
+            ('/api/comments/thread/{root.thread_id}/tree/', 6),
+            # and the thread id and the retrieved comment, before its subtree
+            ('/api/comments/{root.pk}/', 8),
+            # and the thread id, the parent, a page of replies and their subtrees
+            ('/api/comments/{root.pk}/replies/', 9),
+        ):
+            for root in (self.small, self.large):
+                with self.subTest(path=path, thread_id=root.thread_id):
+                    # Tenant, token and thread cache lookups all miss, as on a first read
+                    caches['default'].clear()
+                    tenant_cache.clear()
+                    token_cache.clear()
+                    with self.assertNumStatements(num):
+                        response = self.client.get(path.format(root=root))
+                    self.assertEqual(response.status_code, 200)
+
+
+@override_settings(QUERY_INSPECTION='raise')
+class QueryBudgetTests(APITestCase):
+    """
+    Every CommentViewSet action on wide and deep threads, with
+    QueryInspectionMiddleware failing any request over its action's budget
+    or repeating a statement QUERY_REPEAT_THRESHOLD times.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = self.login('ann')
+        users = [self.user] + [User.objects.create_user(f'user{i}', f'user{i}@example.com') for i in range(5)]
+        self.root, self.deepest = build_thread(users, 'chart-1', width=20, depth=20)
+        for i in range(10):
+            build_thread(users, f'chart-{i + 2}', width=2)
+
+    def request(self, method, path, data=None):
+        response = getattr(self.client, method)(path, data, content_type='application/json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response
+
+    def test_reads(self):
+        for path in (
+            '/api/comments/',
+            '/api/comments/?search=energy',
+            '/api/comments/?thread_prefix=chart',
+            f'/api/comments/{self.root.pk}/',
+            f'/api/comments/{self.root.pk}/?max_depth=2&max_children=5',
+            f'/api/comments/{self.root.pk}/replies/',
+            f'/api/comments/{self.root.pk}/replies/?max_depth=3&max_children=5',
+            f'/api/comments/{self.deepest.pk}/ancestors/',
+            '/api/comments/thread/chart-1/tree/',
+            '/api/comments/thread/chart-1/tree/?max_depth=4&max_children=3',
+            f'/api/comments/{self.root.replies.first().pk}/likers/',
+        ):
+            with self.subTest(path=path):
+                # Once filling the thread cache, once as a conditional GET it answers
+                etag = self.request('get', path)['ETag']
+                self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_writes(self):
+        created = self.request('post', '/api/comments/', {'text': 'New', 'parent': self.deepest.pk}).json()
+        self.request('post', '/api/comments/bulk/', [
+            {'text': f'Bulk {i}', 'parent': self.root.pk} for i in range(10)
+        ] + [{'text': 'Bulk root', 'thread_id': 'chart-99'}])
+        self.request('put', f'/api/comments/{created["id"]}/', {'text': 'Edited'})
+        self.request('patch', f'/api/comments/{created["id"]}/', {'text': 'Edited again'})
+        self.request('post', f'/api/comments/{self.root.pk}/like/')
+        self.request('delete', f'/api/comments/{self.root.pk}/like/')
+        self.request('delete', f'/api/comments/{created["id"]}/')
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.user, self.client = self.login('ann')
+
+    def token_lookups(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/preferences/')
+        return response.status_code, len([query for query in queries if 'authtoken_token' in query['sql']])
+
+    def test_token_is_resolved_once(self):
+        self.assertEqual(self.token_lookups(), (200, 1))
+        self.assertEqual(self.token_lookups(), (200, 0))
+
+    def test_revocation_takes_effect_at_once(self):
+        self.token_lookups()
+        Token.objects.filter(user=self.user).get().delete()
+        self.assertEqual(self.token_lookups()[0], 401)
+
+    def test_deactivated_user_is_refused(self):
+        self.token_lookups()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_lookups()[0], 401)
+
+    def test_entries_are_per_schema(self):
+        self.token_lookups()
+        key = Token.objects.get(user=self.user).key
+        self.assertTrue(token_cache.get(('test', key))[0])
+        self.assertFalse(token_cache.get(('other', key))[0])
+
+    @override_settings(TOKEN_EXPIRY=3600)
+    def test_expired_tokens_are_refused_and_replaced_on_login(self):
+        token = Token.objects.get(user=self.user)
+        Token.objects.filter(pk=token.pk).update(created=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.token_lookups()[0], 401)
+        self.assertNotEqual(create_token(Token, self.user).key, token.key)
+
+
+class BenchmarkBudgetTests(APITestCase):
+    """The benchmark's endpoints on small and large thread shapes, against QUERY_BUDGETS."""
+
+    def run_benchmark(self, prefix, size):
+        # Writes commit only when the test ends, so nothing invalidates the earlier run's entries
+        caches['default'].clear()
+        tenant_cache.clear()
+        users = User.objects.bulk_create([User(username=f'{prefix}-user-{i}') for i in range(size)])
+        shapes = benchmark.Shapes(prefix, [user.pk for user in users], size, size, size, random.Random(0)).build()
+        for comment in shapes.values():
+            Comment.objects.filter(pk=comment.pk).update(replies_count=comment.replies.count())
+            comment.refresh_from_db()
+        _, token = benchmark.ensure_bench_user(f'{prefix}-client')
+        results = {}
+        benchmark.run_endpoints(benchmark.Runner(self.domain.domain, token, results), shapes, requests=2)
+        return benchmark.summarize(results)
+
+    def test_endpoints_stay_within_budget_however_large_the_threads(self):
+        small = self.run_benchmark('small', 3)
+        large = self.run_benchmark('large', 40)
+        self.assertEqual(benchmark.over_budget(large), {})
+        self.assertEqual(
+            {name: stats['queries'] for name, stats in large.items()},
+            {name: stats['queries'] for name, stats in small.items()},
+        )
+
+
+class ReplyTreeTruncationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('ann')
+        # root -> cut -> deleted -> live, and root -> leaf
+        self.root = Comment.objects.create(user=user, text='Root', thread_id='chart-1')
+        self.cut = Comment.objects.create(user=user, text='Cut', parent=self.root)
+        self.deleted = Comment.objects.create(user=user, text='Deleted', parent=self.cut)
+        self.live = Comment.objects.create(user=user, text='Live', parent=self.deleted)
+        self.deleted.soft_delete()
+        self.leaf = Comment.objects.create(user=user, text='Leaf', parent=self.root)
+
+    def nodes(self, data):
+        return {node['id']: node for node in _walk(data)}
+
+    def test_cut_node_with_only_deleted_replies_has_more(self):
+        for path in (
+            f'/api/comments/{self.root.pk}/?max_depth=1',
+            '/api/comments/thread/chart-1/tree/?max_depth=1',
+            f'/api/comments/{self.root.pk}/replies/?max_depth=0',
+        ):
+            with self.subTest(path=path):
+                nodes = self.nodes(self.client.get(path).json())
+                self.assertTrue(nodes[self.cut.pk]['has_more'])
+                self.assertFalse(nodes[self.leaf.pk]['has_more'])
+                self.assertIsNone(nodes[self.leaf.pk]['next'])
+                # Following the continuations reaches the live reply below the deleted one
+                nodes = self.nodes(self.client.get(nodes[self.cut.pk]['next']).json())
+                self.assertTrue(nodes[self.deleted.pk]['has_more'])
+                if self.live.pk not in nodes:
+                    nodes = self.nodes(self.client.get(nodes[self.deleted.pk]['next']).json())
+                self.assertEqual(nodes[self.live.pk]['text'], 'Live')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTests(APITestCase):
+    """
+    replica_0 mirrors the test database on a connection of its own, so it only
+    sees committed rows: the thread built in setUpClass, but not what a test
+    writes inside its transaction, much like a lagging replica.
+    """
+    databases = {'default', 'replica_0'}
+    replica_paths = (
+        '/api/comments/',
+        '/api/comments/{root}/',
+        '/api/comments/{root}/replies/',
+        '/api/comments/{deepest}/ancestors/',
+        '/api/comments/{reply}/likers/',
+        '/api/comments/thread/chart-1/tree/',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        users = [User.objects.create_user('bob'), User.objects.create_user('cy')]
+        cls.root, cls.deepest = build_thread(users, 'chart-1', width=2, depth=2)
+        cls.reply = cls.root.replies.first()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Its session would keep the test database from being dropped
+        connections['replica_0'].close()
+        super().tearDownClass()
+
+    def get(self, client, path):
+        """GET `path`, returning the response and the comment queries run on the primary and on the replica."""
+        with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(connections['replica_0']) as replica:
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, *(
+            [query['sql'] for query in queries if 'comments_comment' in query['sql']]
+            for queries in (primary.captured_queries, replica.captured_queries)
+        )
+
+    def tree_texts(self, client):
+        response, _, _ = self.get(client, '/api/comments/thread/chart-1/tree/')
+        return {node['text'] for node in _walk(response.json())}
+
+    def test_reads_go_to_the_replica_in_the_tenant_schema(self):
+        for path in self.replica_paths:
+            path = path.format(root=self.root.pk, deepest=self.deepest.pk, reply=self.reply.pk)
+            with self.subTest(path=path):
+                connections['replica_0'].set_schema_to_public()
+                with CaptureQueriesContext(connections['replica_0']) as replica:
+                    _, on_primary, on_replica = self.get(self.client, path)
+                self.assertEqual(on_primary, [])
+                self.assertNotEqual(on_replica, [])
+                self.assertEqual(connections['replica_0'].schema_name, self.tenant.schema_name)
+                self.assertTrue(any(
+                    is_schema_switch(query['sql']) and self.tenant.schema_name in query['sql']
+                    for query in replica.captured_queries
+                ))
+
+    def test_writes_go_to_the_primary_and_pin_the_writer(self):
+        _, writer = self.login('ann')
+        self.assertNotIn('New', self.tree_texts(writer))
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as primary, CaptureQueriesContext(connections['replica_0']) as replica:
+                response = writer.post(
+                    '/api/comments/', {'text': 'New', 'parent': self.root.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(any(query['sql'].startswith('INSERT') for query in primary.captured_queries))
+        self.assertEqual(replica.captured_queries, [])
+
+        # Other clients still read from the replica, which has not caught up;
+        # being that close to the write, their read is not cached
+        self.assertNotIn('New', self.tree_texts(self.client))
+        _, _, on_replica = self.get(self.client, '/api/comments/thread/chart-1/tree/')
+        self.assertNotEqual(on_replica, [])
+        # The writer reads its comment from the primary, past the cache
+        _, _, on_replica = self.get(writer, '/api/comments/thread/chart-1/tree/')
+        self.assertEqual(on_replica, [])
+        self.assertIn('New', self.tree_texts(writer))
+        # and that primary read is cached for everyone
+        self.assertIn('New', self.tree_texts(self.client))
+
+    def test_replica_reads_fill_the_cache_once_the_last_write_settled(self):
+        # The thread's version was just created, so a write may be that recent
+        for _ in range(2):
+            _, _, on_replica = self.get(self.client, '/api/comments/thread/chart-1/tree/')
+            self.assertNotEqual(on_replica, [])
+        with self.settings(REPLICA_STICKY_SECONDS=0):
+            self.get(self.client, '/api/comments/thread/chart-1/tree/')
+            _, _, on_replica = self.get(self.client, '/api/comments/thread/chart-1/tree/')
+        self.assertEqual(on_replica, [])
+
+
+class CommentEventTests(APITestCase):
+    """Writes through the API reach subscribers of their thread on the in-process backend."""
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.client = self.login('ann')
+        self.root = Comment.objects.create(user=self.user, text='Root', thread_id='chart-1')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def post(self, path, data=None):
+        return self.client.post(path, data, content_type='application/json')
+
+    def test_writes_reach_their_thread_subscribers(self):
+        subscription = events.backend.subscribe(events.thread_channel(self.tenant.schema_name, 'chart-1'))
+        queue = self.loop.run_until_complete(subscription.__aenter__())
+        try:
+            # Events are published on commit
+            with self.captureOnCommitCallbacks(execute=True):
+                created = self.post('/api/comments/', {'text': 'New', 'parent': self.root.pk}).json()
+                self.client.patch(f'/api/comments/{created["id"]}/', {'text': 'Edited'}, content_type='application/json')
+                self.post(f'/api/comments/{created["id"]}/like/')
+                self.client.delete(f'/api/comments/{created["id"]}/')
+                self.post('/api/comments/', {'text': 'Elsewhere', 'thread_id': 'chart-2'})
+            # Run the deliveries the backend scheduled on the subscriber's loop
+            self.loop.run_until_complete(asyncio.sleep(0))
+            messages = []
+            while not queue.empty():
+                messages.append(json.loads(queue.get_nowait()))
+        finally:
+            self.loop.run_until_complete(subscription.__aexit__(None, None, None))
+
+        self.assertEqual(
+            [(message['type'], message['comment']['id']) for message in messages],
+            [(event_type, created['id']) for event_type in (
+                'comment.created', 'comment.updated', 'comment.likes', 'comment.deleted')],
+        )
+        self.assertEqual(messages[0]['comment']['text'], 'New')
+        self.assertEqual(messages[1]['comment']['text'], 'Edited')
+        self.assertEqual(messages[2]['comment']['likes_count'], 1)
+        self.assertEqual(messages[3]['comment']['parent'], self.root.pk)
+
+
+class IdempotentWriteTests(APITestCase):
+    """Repeating a like, an unlike or a delete changes counters and queues mail only once."""
+
+    def setUp(self):
+        super().setUp()
+        self.author, self.author_client = self.login('ann')
+        self.user, self.client = self.login('bob')
+        self.root = Comment.objects.create(user=self.author, text='Root', thread_id='chart-1')
+        self.reply = Comment.objects.create(user=self.author, text='Reply', parent=self.root)
+
+    def counts(self):
+        self.root.refresh_from_db()
+        self.reply.refresh_from_db()
+        return self.reply.likes_count, self.root.replies_count, OutboxMessage.objects.count()
+
+    def test_model_methods(self):
+        self.assertEqual([self.reply.add_like(self.user) for _ in range(2)], [True, False])
+        self.assertEqual(self.counts(), (1, 1, 0))
+        self.assertEqual([self.reply.remove_like(self.user) for _ in range(2)], [True, False])
+        self.assertEqual(self.counts(), (0, 1, 0))
+        self.assertEqual([self.reply.soft_delete() for _ in range(2)], [True, False])
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_api(self):
+        path = f'/api/comments/{self.reply.pk}/like/'
+        responses = [self.client.post(path).json() for _ in range(2)]
+        self.assertEqual([(r['changed'], r['likes_count']) for r in responses], [(True, 1), (False, 1)])
+        # One mail to the author, for the like that was new
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+        responses = [self.client.delete(path).json() for _ in range(2)]
+        self.assertEqual([(r['changed'], r['likes_count']) for r in responses], [(True, 0), (False, 0)])
+        self.assertEqual(self.counts(), (0, 1, 1))
+
+        statuses = [self.author_client.delete(f'/api/comments/{self.reply.pk}/').status_code for _ in range(2)]
+        self.assertEqual(statuses, [204, 400])
+        self.assertEqual(self.counts(), (0, 0, 1))
+
+
+def _walk(data):
+    # Comment nodes of a retrieve, tree or replies response
+    if isinstance(data, dict) and 'results' in data:
+        data = data['results']
+    for node in data if isinstance(data, list) else [data]:
+        yield node
+        yield from _walk(node['replies'])
@@ -0,0 +1,138 @@
+"""
+Token-bucket throttling per tenant, user (or client IP) and scope.
+
+A view names its scope with `throttle_scope`, or per action with
+`throttle_scopes`. Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']
+and a tenant can override them in Client.throttle_rates. A rate of
+"30/minute" is a bucket of 30 tokens that refills at 30 a minute, so a
+client may burst up to 30 requests and then gets one every two seconds.
+
+Buckets live in the default cache, whose keys are already prefixed with the
+tenant schema. A bucket is two keys: when it started and how many tokens
+were spent since, the latter only ever changed with cache.incr/decr, so
+concurrent requests on a shared cache (redis, memcached) cannot overspend.
+A request in a throttled scope costs three cache operations and no query.
+A view can charge several tokens for one request with get_throttle_cost().
+"""
+import time
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/minute' -> (30 tokens, 30 / 60 tokens per second); None for no limit."""
+    if not rate:
+        return None
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def validate_throttle_rates(rates):
+    """Validator of Client.throttle_rates: {scope: '30/minute' or null for no limit}."""
+    if not isinstance(rates, dict):
+        raise ValidationError('Expected an object of scope: rate.')
+    for scope, rate in rates.items():
+        try:
+            limits = parse_rate(rate)
+        except (AttributeError, KeyError, IndexError, ValueError):
+            limits = ()
+        if limits == () or (limits is not None and limits[0] < 1):
+            raise ValidationError(f'{scope}: {rate!r} is not a rate like "30/minute".')
+
+
+class TokenBucket:
+    def __init__(self, key, capacity, refill_rate):
+        self.key = key
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        # Idle keys expire; a missing bucket is a full one
+        self.timeout = int(capacity / refill_rate) + 60
+
+    def take(self, cost=1, now=None):
+        """
+        Spend `cost` tokens; returns (allowed, tokens left, seconds until the
+        request could pass). A request costing more than the bucket holds
+        passes when the bucket is full and leaves it in debt.
+        """
+        now = time.time() if now is None else now
+        start_key, spent_key = f'{self.key}:start', f'{self.key}:spent'
+        if cache.add(start_key, now, self.timeout):
+            cache.set(spent_key, 0, self.timeout)
+        try:
+            spent = cache.incr(spent_key, cost)
+        except ValueError:
+            cache.set(spent_key, cost, self.timeout)
+            spent = cost
+        start = cache.get(start_key, now)
+
+        before = self.capacity + (now - start) * self.refill_rate - (spent - cost)
+        needed = min(cost, self.capacity)
+        if before < needed:
+            # Refund the tokens this request did not get
+            cache.decr(spent_key, cost)
+            return False, max(int(before), 0), (needed - before) / self.refill_rate
+        if before > self.capacity:
+            # The bucket was idle long enough to be full: restart it from here, so
+            # credit does not pile up. A concurrent restart only loses its own tokens.
+            cache.set(start_key, now - (spent - cost) / self.refill_rate, self.timeout)
+            before = self.capacity
+        return True, max(int(before - cost), 0), 0.0
+
+
+class TenantRateThrottle(BaseThrottle):
+    """DRF throttle over TokenBucket; sets `request.rate_limit` for RateLimitHeadersMixin."""
+
+    def get_cost(self, request, view):
+        # Views may charge more than one token for a request, e.g. one per created item
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        return get_throttle_cost(request) if get_throttle_cost else 1
+
+    def get_scope(self, view):
+        scopes = getattr(view, 'throttle_scopes', {})
+        return scopes.get(getattr(view, 'action', None)) or getattr(view, 'throttle_scope', None)
+
+    def get_rate(self, request, scope):
+        overrides = getattr(getattr(request, 'tenant', None), 'throttle_rates', None) or {}
+        if scope in overrides:
+            return overrides[scope]
+        return api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        limits = parse_rate(self.get_rate(request, scope)) if scope else None
+        if limits is None:
+            return True
+        capacity, refill_rate = limits
+        if request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        bucket = TokenBucket(f'throttle:{scope}:{ident}', capacity, refill_rate)
+        allowed, remaining, self.retry_after = bucket.take(self.get_cost(request, view))
+        # Seconds until the bucket is full again
+        reset = (capacity - remaining) / refill_rate
+        request.rate_limit = (capacity, remaining, reset)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class RateLimitHeadersMixin:
+    """Adds RateLimit-Limit/-Remaining/-Reset to responses of throttled views."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            limit, remaining, reset = rate_limit
+            response['RateLimit-Limit'] = str(limit)
+            response['RateLimit-Remaining'] = str(remaining)
+            response['RateLimit-Reset'] = str(int(reset + 0.999))
+        return response
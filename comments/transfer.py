@@ -0,0 +1,252 @@
+"""
+Streaming NDJSON export and import of a tenant's comments, likes and users.
+
+One JSON object per line, tagged with its "type":
+
+    {"type": "user", "id": 3, "username": "ada", "email": "ada@example.com", "first_name": "", "last_name": ""}
+    {"type": "comment", "id": 7, "user": 3, "parent": null, "thread_id": "site/chart-1", "text": "...",
+     "is_deleted": false, "created_at": "...", "updated_at": "..."}
+    {"type": "like", "comment": 7, "user": 3}
+
+Ids are those of the exporting schema. The export writes users first, and the
+importer needs every user line before the comments and likes that refer to
+it; comments and likes may come in any order.
+
+The importer keeps one dict of user ids. Comments and likes are staged in
+temporary tables and resolved with set-based SQL at the end, so memory does
+not grow with the number of comments in the file.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.dateparse import parse_datetime
+
+from . import cache as thread_cache
+from .models import Comment
+
+Like = Comment.liked_by.through
+
+
+def _line(record):
+    return json.dumps(record) + '\n'
+
+
+def export_lines(chunk_size=2000):
+    """Yield the current schema as NDJSON lines, reading through server-side cursors."""
+    users = User.objects.filter(
+        Q(Exists(Comment.objects.filter(user=OuterRef('pk'))))
+        | Q(Exists(Like.objects.filter(user=OuterRef('pk'))))
+    ).order_by('id')
+    for pk, username, email, first_name, last_name in users.values_list(
+        'id', 'username', 'email', 'first_name', 'last_name',
+    ).iterator(chunk_size=chunk_size):
+        yield _line({
+            'type': 'user', 'id': pk, 'username': username, 'email': email,
+            'first_name': first_name, 'last_name': last_name,
+        })
+
+    comments = Comment.objects.order_by('id').values_list(
+        'id', 'user_id', 'parent_id', 'thread_id', 'text', 'is_deleted', 'created_at', 'updated_at',
+    )
+    for pk, user_id, parent_id, thread_id, text, is_deleted, created_at, updated_at in comments.iterator(chunk_size=chunk_size):
+        yield _line({
+            'type': 'comment', 'id': pk, 'user': user_id, 'parent': parent_id, 'thread_id': thread_id,
+            'text': text, 'is_deleted': is_deleted,
+            # Full precision: pagination keys on created_at
+            'created_at': created_at.isoformat(), 'updated_at': updated_at.isoformat(),
+        })
+
+    likes = Like.objects.order_by('id').values_list('comment_id', 'user_id')
+    for comment_id, user_id in likes.iterator(chunk_size=chunk_size):
+        yield _line({'type': 'like', 'comment': comment_id, 'user': user_id})
+
+
+class TransferError(Exception):
+    def __init__(self, line_number, message):
+        super().__init__(f'line {line_number}: {message}')
+
+
+STAGING_TABLES = """
+CREATE TEMPORARY TABLE comment_import (
+    old_id bigint PRIMARY KEY,
+    new_id bigint NOT NULL,
+    old_parent_id bigint,
+    created_at timestamptz NOT NULL,
+    updated_at timestamptz NOT NULL
+) ON COMMIT DROP;
+CREATE TEMPORARY TABLE comment_like_import (
+    old_comment_id bigint NOT NULL,
+    user_id integer NOT NULL
+) ON COMMIT DROP;
+"""
+
+# Restore timestamps (bulk_create applies auto_now_add / auto_now) and link
+# replies to the new ids of their parents. A reply whose parent is not in the
+# file becomes a root and keeps its own thread_id.
+LINK_PARENTS = """
+UPDATE comments_comment c
+SET parent_id = p.new_id, created_at = i.created_at, updated_at = i.updated_at
+FROM comment_import i LEFT JOIN comment_import p ON p.old_id = i.old_parent_id
+WHERE c.id = i.new_id
+"""
+
+# thread_id, path and depth follow from the parent, as in Comment.save;
+# walk the imported trees from their roots in one statement.
+INHERIT_FROM_PARENTS = """
+WITH RECURSIVE tree (id, thread_id, path, depth) AS (
+    SELECT c.id, c.thread_id, ''::text, 0
+    FROM comments_comment c JOIN comment_import i ON c.id = i.new_id
+    WHERE c.parent_id IS NULL
+    UNION ALL
+    SELECT c.id, tree.thread_id, tree.path || tree.id || '/', tree.depth + 1
+    FROM comments_comment c JOIN tree ON c.parent_id = tree.id
+)
+UPDATE comments_comment
+SET thread_id = tree.thread_id, path = tree.path, depth = tree.depth
+FROM tree
+WHERE comments_comment.id = tree.id AND tree.depth > 0
+"""
+
+INSERT_LIKES = """
+INSERT INTO comments_comment_liked_by (comment_id, user_id)
+SELECT i.new_id, l.user_id
+FROM comment_like_import l JOIN comment_import i ON i.old_id = l.old_comment_id
+ON CONFLICT DO NOTHING
+"""
+
+COUNT_LIKES_AND_REPLIES = """
+UPDATE comments_comment c
+SET likes_count = (SELECT count(*) FROM comments_comment_liked_by l WHERE l.comment_id = c.id),
+    replies_count = (SELECT count(*) FROM comments_comment r WHERE r.parent_id = c.id AND NOT r.is_deleted)
+FROM comment_import i
+WHERE c.id = i.new_id
+"""
+
+IMPORTED_THREADS = """
+SELECT DISTINCT c.thread_id FROM comments_comment c JOIN comment_import i ON c.id = i.new_id
+"""
+
+
+class Importer:
+    """
+    Load NDJSON lines into the current schema in one transaction.
+
+    Users are matched on username and created when missing. Comments are
+    inserted with bulk_create, `batch_size` at a time, and never go through
+    Comment.save: parents, thread_id inheritance, paths and counters are
+    resolved afterwards from the staging tables.
+    """
+
+    def __init__(self, batch_size=2000):
+        self.batch_size = batch_size
+        self.user_ids = {}
+        self.users = []
+        self.comments = []
+        self.likes = []
+        self.stats = {'users': 0, 'comments': 0, 'likes': 0}
+
+    def run(self, lines):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(STAGING_TABLES)
+            for line_number, line in enumerate(lines, 1):
+                if isinstance(line, bytes):
+                    line = line.decode()
+                if line.strip():
+                    self.add(line_number, line)
+            self.flush_users()
+            self.flush_comments()
+            self.flush_likes()
+            with connection.cursor() as cursor:
+                cursor.execute(LINK_PARENTS)
+                cursor.execute(INHERIT_FROM_PARENTS)
+                cursor.execute(INSERT_LIKES)
+                self.stats['likes'] = cursor.rowcount
+                cursor.execute(COUNT_LIKES_AND_REPLIES)
+                cursor.execute(IMPORTED_THREADS)
+                scopes = [thread_cache.thread_scope(thread_id) for thread_id, in cursor.fetchall()]
+            schema_name = connection.schema_name
+            transaction.on_commit(lambda: thread_cache.invalidate([thread_cache.ROOTS, *scopes], schema_name))
+        return self.stats
+
+    def add(self, line_number, line):
+        try:
+            record = json.loads(line)
+            kind = record['type']
+            if kind == 'user':
+                self.users.append(record)
+                if len(self.users) >= self.batch_size:
+                    self.flush_users()
+            elif kind == 'comment':
+                self.flush_users()
+                self.comments.append(self.build_comment(record))
+                if len(self.comments) >= self.batch_size:
+                    self.flush_comments()
+            elif kind == 'like':
+                self.flush_users()
+                self.likes.append((record['comment'], self.user_ids[record['user']]))
+                if len(self.likes) >= self.batch_size:
+                    self.flush_likes()
+            else:
+                raise TransferError(line_number, f'unknown record type {kind!r}')
+        except KeyError as e:
+            raise TransferError(line_number, f'missing field or unknown user {e}')
+        except (TypeError, ValueError) as e:
+            raise TransferError(line_number, e)
+
+    def build_comment(self, record):
+        created_at = parse_datetime(record['created_at'])
+        updated_at = parse_datetime(record.get('updated_at') or record['created_at'])
+        if created_at is None or updated_at is None:
+            raise ValueError('invalid timestamp')
+        comment = Comment(
+            user_id=self.user_ids[record['user']],
+            text=record['text'],
+            thread_id=record.get('thread_id') or '',
+            is_deleted=record.get('is_deleted', False),
+        )
+        return comment, (record['id'], record.get('parent'), created_at, updated_at)
+
+    def flush_users(self):
+        if not self.users:
+            return
+        User.objects.bulk_create(
+            [
+                User(
+                    username=record['username'], email=record.get('email', ''),
+                    first_name=record.get('first_name', ''), last_name=record.get('last_name', ''),
+                )
+                for record in self.users
+            ],
+            ignore_conflicts=True,
+        )
+        existing = dict(
+            User.objects.filter(username__in=[record['username'] for record in self.users])
+            .values_list('username', 'id')
+        )
+        for record in self.users:
+            self.user_ids[record['id']] = existing[record['username']]
+        self.stats['users'] += len(self.users)
+        self.users = []
+
+    def flush_comments(self):
+        if not self.comments:
+            return
+        Comment.objects.bulk_create([comment for comment, _ in self.comments])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO comment_import (old_id, new_id, old_parent_id, created_at, updated_at) '
+                'VALUES (%s, %s, %s, %s, %s)',
+                [(old_id, comment.pk, *rest) for comment, (old_id, *rest) in self.comments],
+            )
+        self.stats['comments'] += len(self.comments)
+        self.comments = []
+
+    def flush_likes(self):
+        if not self.likes:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO comment_like_import (old_comment_id, user_id) VALUES (%s, %s)', self.likes)
+        self.likes = []
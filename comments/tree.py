@@ -0,0 +1,97 @@
+from django.db.models import BigIntegerField, Case, F, When, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+
+
+def attach_replies(comment, replies):
+    # Fill the prefetch cache the same way prefetch_related('replies') would,
+    # so `comment.replies.all()` is served from memory.
+    queryset = comment.replies.all()
+    queryset._result_cache = list(replies)
+    queryset._prefetch_done = True
+    if not hasattr(comment, '_prefetched_objects_cache'):
+        comment._prefetched_objects_cache = {}
+    comment._prefetched_objects_cache['replies'] = queryset
+
+
+def build_reply_tree(comments):
+    """
+    Assemble the parent/child tree of already loaded comments in memory.
+
+    Returns the roots, i.e. the comments whose parent is not part of
+    `comments`. Sibling order follows the order of `comments`.
+    """
+    comments = list(comments)
+    children = {comment.pk: [] for comment in comments}
+    roots = []
+
+    for comment in comments:
+        if comment.parent_id in children:
+            children[comment.parent_id].append(comment)
+        else:
+            roots.append(comment)
+
+    for comment in comments:
+        attach_replies(comment, children[comment.pk])
+
+    return roots
+
+
+def limit_siblings(comments, max_children=None):
+    """
+    Keep the newest `max_children + 1` replies of every parent, newest first.
+
+    The extra reply lets truncate_reply_tree tell whether a parent has more
+    replies than it shows. Roots are never cut. Descendants of cut replies are
+    still loaded, so combine this with a depth limit on busy threads.
+    """
+    comments = comments.order_by('-created_at', '-id')
+    if max_children is None:
+        return comments
+    # Each root gets a partition of its own, keyed by its negated id.
+    siblings = Case(When(parent__isnull=True, then=-F('id')), default=F('parent_id'), output_field=BigIntegerField())
+    return comments.annotate(
+        sibling_rank=Window(RowNumber(), partition_by=siblings, order_by=[F('created_at').desc(), F('id').desc()]),
+    ).filter(sibling_rank__lte=max_children + 1)
+
+
+def truncate_reply_tree(roots, max_depth=None, max_children=None):
+    """
+    Cut a tree assembled by build_reply_tree to `max_depth` levels below the
+    roots and `max_children` replies per comment.
+
+    Every node gets `has_more` (it has replies that are not shown) and
+    `last_shown_reply` (the reply to continue after, None when the node was
+    cut at the depth limit and its replies start from the first one).
+    """
+    cut = []
+    stack = [(root, 0) for root in roots]
+    while stack:
+        comment, level = stack.pop()
+        replies = list(comment.replies.all())
+        comment.has_more = False
+        comment.last_shown_reply = None
+
+        if max_depth is not None and level >= max_depth:
+            comment.has_more = comment.replies_count > 0
+            if not comment.has_more:
+                cut.append(comment)
+            replies = []
+        elif max_children is not None and len(replies) > max_children:
+            replies = replies[:max_children]
+            comment.has_more = True
+            comment.last_shown_reply = replies[-1]
+
+        attach_replies(comment, replies)
+        stack.extend((reply, level + 1) for reply in replies)
+
+    if cut:
+        # replies_count leaves deleted replies out, but trees show them and their
+        # live replies; one query finds the cut nodes that only have deleted ones.
+        replied = set(
+            Comment.objects.filter(parent__in=[comment.pk for comment in cut])
+            .order_by().values_list('parent_id', flat=True).distinct()
+        )
+        for comment in cut:
+            comment.has_more = comment.pk in replied
@@ -1,7 +1,10 @@
+from django.urls import re_path
 from rest_framework.routers import DefaultRouter
-from .views import CommentViewSet
+from .views import CommentViewSet, thread_events
 
 router = DefaultRouter()
 router.register(r'', CommentViewSet, basename='comment')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = [
+    re_path(r'^thread/(?P<thread_id>.+)/events/$', thread_events, name='comment-thread-events'),
+] + router.urls
\ No newline at end of file
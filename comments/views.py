@@ -1,16 +1,31 @@
+import asyncio
+import json
+
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 
 from allauth.account.views import ConfirmEmailView
-from django.shortcuts import render
-
-from .models import Comment
-from .serializers import CommentCreateSerializer, CommentSerializer, CommentListSerializer, CommentUpdateSerializer
+from django.shortcuts import get_object_or_404, render
+from django.http import StreamingHttpResponse
+
+from . import cache as thread_cache
+from . import events
+from .events import publish_comment_event, thread_channel
+from .authentication import create_token
+from .conditional import conditional_read
+from .models import Comment, NotificationPreference
+from .notifications import enqueue_mail, enqueue_messages, outbox_messages
+from .pagination import CommentCursorPagination, CommentSearchPagination, LikerPagination
+from .routers import ReplicaReadsMixin
+from .search import CommentSearchFilter, attach_headlines, get_search_config
+from .throttling import RateLimitHeadersMixin
+from .tree import build_reply_tree, limit_siblings, truncate_reply_tree
+from .serializers import BulkCommentCreateSerializer, CommentCreateSerializer, LikerSerializer, CommentSerializer, CommentListSerializer, CommentUpdateSerializer, NotificationPreferenceSerializer, ReplyTreeQuerySerializer
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters
 
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
@@ -31,81 +46,290 @@ class CommentFilter(django_filters.FilterSet):
         model = Comment
         fields = []
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all().select_related('user', 'parent').prefetch_related('replies', 'liked_by')
+class CommentViewSet(RateLimitHeadersMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.all().select_related('user', 'parent')
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    search_fields = ['text']
+    filter_backends = [DjangoFilterBackend, CommentSearchFilter]
     filterset_class = CommentFilter
+    pagination_class = CommentCursorPagination
+    # Most queries per action, whatever the size of the page or thread, token
+    # authentication included. Enforced per request by comments.querycheck and
+    # by `benchmark_comments` (comments.benchmark.QUERY_BUDGETS).
+    query_budgets = {
+        'list': 9,  # with ?search=
+        'retrieve': 9,
+        'replies': 9,
+        'ancestors': 7,
+        'thread_tree': 9,
+        'likers': 7,
+        'create': 11,
+        'bulk': 15,
+        'like': 11,
+        'update': 12,
+        'partial_update': 12,
+        'destroy': 12,
+    }
+    # Served from a read replica when DATABASE_REPLICAS are configured (comments.routers)
+    replica_actions = ('list', 'retrieve', 'thread_tree', 'replies', 'ancestors', 'likers')
+    throttle_scopes = {
+        'create': 'comment_write',
+        'bulk': 'comment_write',
+        'update': 'comment_write',
+        'partial_update': 'comment_write',
+        'destroy': 'comment_write',
+        'like': 'like',
+    }
+
+    def get_throttle_cost(self, request):
+        # One comment_write token per comment created, as if they were posted one by one
+        if self.action == 'bulk' and isinstance(request.data, list):
+            return max(len(request.data), 1)
+        return 1
+
+    @property
+    def paginator(self):
+        # Ranked search results have no stable time key to page on
+        if not hasattr(self, '_paginator'):
+            if self.action == 'list' and CommentSearchFilter.get_search_text(self.request):
+                self._paginator = CommentSearchPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_serializer_class(self):
         if self.action == 'create':
             return CommentCreateSerializer
+        elif self.action == 'bulk':
+            return BulkCommentCreateSerializer
         elif self.action == 'update' or self.action == 'partial_update':
             return CommentUpdateSerializer
-        elif self.action == 'list':
+        elif self.action in ('list', 'ancestors'):
             return CommentListSerializer
         return CommentSerializer
 
     def get_queryset(self):
         if self.action == 'list':
-            return Comment.objects.filter(parent=None)
+            return Comment.objects.filter(parent=None).select_related('user')
         return super().get_queryset()
 
-    def perform_create(self, serializer):
-        comment = serializer.save(user=self.request.user)
-        actor = comment.user
-
-        # Collect all participants in the same thread except the actor
-        participant_emails = (
-            Comment.objects
-            .filter(thread_id=comment.thread_id)
-            .exclude(user=actor)
-            .values_list('user__email', flat=True)
-            .distinct()
-        )
+    def get_freshness_queryset(self):
+        # Rows whose newest updated_at and count fingerprint a read response
+        if self.action == 'list':
+            return self.filter_queryset(self.get_queryset())
+        if self.action == 'thread_tree':
+            return Comment.objects.filter(thread_id=self.kwargs['thread_id'])
+        thread_id = thread_cache.get_comment_thread_id(self.kwargs['pk'])
+        if thread_id is None:
+            return Comment.objects.none()
+        return Comment.objects.filter(thread_id=thread_id)
+
+    def get_cache_scope(self):
+        # Cache scope of a read action, see comments.cache
+        if self.action == 'list':
+            return thread_cache.ROOTS
+        if self.action == 'thread_tree':
+            return thread_cache.thread_scope(self.kwargs['thread_id'])
+        thread_id = thread_cache.get_comment_thread_id(self.kwargs['pk'])
+        if thread_id is None:
+            return None
+        return thread_cache.thread_scope(thread_id)
 
-        recipients = [email for email in participant_emails if email]
-
-        if recipients:
-            subject = f"New comment in thread {comment.thread_id}"
-            message = f"{actor.username} wrote:\n\n{comment.text}"
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                recipients,
-                fail_silently=True,
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            comment = serializer.save(user=self.request.user)
+            actor = comment.user
+
+            # Collect all participants in the same thread except the actor,
+            # with their notification preference
+            participants = (
+                Comment.objects
+                .filter(thread_id=comment.thread_id)
+                .exclude(user=actor)
+                .values_list('user__email', 'user__notification_preference__mode')
+                .distinct()
             )
 
+            recipients = [(email, mode) for email, mode in participants if email]
+
+            if recipients:
+                subject = f"New comment in thread {comment.thread_id}"
+                message = f"{actor.username} wrote:\n\n{comment.text}"
+                enqueue_mail(recipients, subject, message, thread_id=comment.thread_id)
+
+            publish_comment_event('comment.created', comment, CommentListSerializer(comment).data)
+
+    @extend_schema(request=BulkCommentCreateSerializer(many=True), responses=CommentListSerializer(many=True))
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def bulk(self, request):
+        """
+        Create a list of comments at once. Nothing is written unless every
+        item is valid, and each thread's participants get one notification
+        for the whole batch.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, max_length=settings.COMMENTS_BULK_MAX_SIZE)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            comments = serializer.save()
+            actor = request.user
+
+            threads = {}
+            for comment in comments:
+                threads.setdefault(comment.thread_id, []).append(comment)
+
+            participants = (
+                Comment.objects
+                .filter(thread_id__in=threads)
+                .exclude(user=actor)
+                .values_list('thread_id', 'user__email', 'user__notification_preference__mode')
+                .distinct()
+            )
+            recipients = {}
+            for thread_id, email, mode in participants:
+                if email:
+                    recipients.setdefault(thread_id, []).append((email, mode))
+
+            messages = []
+            for thread_id, created in threads.items():
+                if recipients.get(thread_id):
+                    subject = f"{len(created)} new comment(s) in thread {thread_id}"
+                    message = "\n\n".join(f"{actor.username} wrote:\n\n{comment.text}" for comment in created)
+                    messages += outbox_messages(recipients[thread_id], subject, message, thread_id=thread_id)
+                # bulk_create sends no post_save, so invalidate here; the shallowest comment covers the root listing
+                thread_cache.invalidate_comment(min(created, key=lambda comment: comment.depth))
+            enqueue_messages(messages)
+
+            data = CommentListSerializer(comments, many=True).data
+            for comment, item in zip(comments, data):
+                publish_comment_event('comment.created', comment, item)
+
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def perform_update(self, serializer):
+        comment = serializer.save()
+        publish_comment_event('comment.updated', comment, CommentListSerializer(comment).data)
+
+    def publish_likes(self, comment):
+        comment.refresh_from_db(fields=['likes_count'])
+        publish_comment_event('comment.likes', comment, {'id': comment.pk, 'likes_count': comment.likes_count})
+
+    def get_tree_limits(self):
+        params = ReplyTreeQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data.get('max_depth'), params.validated_data.get('max_children')
+
+    @extend_schema(parameters=[ReplyTreeQuerySerializer])
+    @conditional_read
+    def retrieve(self, request, *args, **kwargs):
+        comment = self.get_object()
+        max_depth, max_children = self.get_tree_limits()
+        # The whole subtree is one range scan on the materialized path
+        descendants = limit_siblings(comment.get_descendants(max_depth), max_children)
+        build_reply_tree([comment, *descendants.select_related('user')])
+        truncate_reply_tree([comment], max_depth, max_children)
+        serializer = self.get_serializer(comment)
+        return Response(serializer.data)
+
+    @extend_schema(parameters=[ReplyTreeQuerySerializer])
+    @action(detail=True, methods=['get'])
+    @conditional_read
+    def replies(self, request, pk=None):
+        # A page of direct replies, each expanded like retrieve. This is where
+        # the `next` links of truncated nodes point.
+        comment = self.get_object()
+        max_depth, max_children = self.get_tree_limits()
+        if max_children is not None:
+            self.paginator.page_size = max_children
+        page = self.paginate_queryset(
+            comment.replies.select_related('user')
+        )
 
+        subtrees = Q()
+        for reply in page:
+            subtrees |= Q(path__startswith=reply.subtree_path)
+        descendants = Comment.objects.none()
+        if page and (max_depth is None or max_depth > 1):
+            descendants = Comment.objects.filter(subtrees)
+            if max_depth is not None:
+                descendants = descendants.filter(depth__lte=comment.depth + max_depth)
+            descendants = limit_siblings(descendants, max_children).select_related('user')
+
+        build_reply_tree([*page, *descendants])
+        truncate_reply_tree(page, None if max_depth is None else max(max_depth - 1, 0), max_children)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    @conditional_read
+    def ancestors(self, request, pk=None):
+        comment = self.get_object()
+        ancestors = comment.get_ancestors().select_related('user')
+        serializer = self.get_serializer(ancestors, many=True)
+        return Response(serializer.data)
+
+    @extend_schema(parameters=[ReplyTreeQuerySerializer])
+    @action(detail=False, methods=['get'], url_path=r'thread/(?P<thread_id>.+)/tree')
+    @conditional_read
+    def thread_tree(self, request, thread_id=None):
+        # One query for the comments, then the tree is assembled in memory
+        # instead of one query per reply.
+        max_depth, max_children = self.get_tree_limits()
+        comments = Comment.objects.filter(thread_id=thread_id)
+        if max_depth is not None:
+            comments = comments.filter(depth__lte=max_depth)
+        comments = limit_siblings(comments, max_children).select_related('user')
+        roots = [comment for comment in build_reply_tree(comments) if comment.parent_id is None]
+        truncate_reply_tree(roots, max_depth, max_children)
+        serializer = self.get_serializer(roots, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=LikerPagination)
+    @conditional_read
+    def likers(self, request, pk=None):
+        # Newest likes first, a page at a time however popular the comment is
+        comment = self.get_object()
+        page = self.paginate_queryset(
+            Comment.liked_by.through.objects.filter(comment=comment).select_related('user')
+        )
+        serializer = LikerSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-    
-    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    @action(detail=True, methods=['post', 'delete'], permission_classes=[permissions.IsAuthenticated])
     def like(self, request, pk=None):
-        comment = self.get_object()
-        comment.liked_by.add(request.user)
-
-        # Send email to the comment's author (if not liking their own)
-        if comment.user.email and comment.user != request.user:
-            subject = f"{request.user.username} liked your comment"
-            message = f"Hi {comment.user.username},\n\n{request.user.username} liked your comment in thread {comment.thread_id}."
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [comment.user.email],
-                fail_silently=True,
-            )
-            
-        return Response({'status': 'liked'}, status=status.HTTP_200_OK)
+        """
+        POST likes the comment, DELETE takes the like back. Both are
+        idempotent; `changed` tells whether this call changed anything.
+        """
+        # Only the columns needed for the write, its event and its cache invalidation
+        comment = get_object_or_404(Comment.objects.only('id', 'user_id', 'thread_id', 'depth', 'likes_count'), pk=pk)
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = comment.add_like(request.user)
+            else:
+                changed = comment.remove_like(request.user)
+            if changed:
+                thread_cache.invalidate_comment(comment)
+                self.publish_likes(comment)
+
+            # Notify the comment's author (if not liking their own), once per new like
+            if changed and request.method == 'POST' and comment.user_id != request.user.pk:
+                author = (
+                    User.objects.filter(pk=comment.user_id)
+                    .values('email', 'username', 'notification_preference__mode')
+                    .first()
+                )
+                if author and author['email']:
+                    subject = f"{request.user.username} liked your comment"
+                    message = f"Hi {author['username']},\n\n{request.user.username} liked your comment in thread {comment.thread_id}."
+                    enqueue_mail(
+                        [(author['email'], author['notification_preference__mode'])],
+                        subject, message, thread_id=comment.thread_id,
+                    )
 
-    
-    @action(detail=True, methods=['get'], permission_classes=[permissions.IsAuthenticated])
-    def unlike(self, request, pk=None):
-        comment = self.get_object()
-        comment.liked_by.remove(request.user)
-        return Response({'status': 'unliked'}, status=status.HTTP_200_OK)
+        return Response({
+            'status': 'liked' if request.method == 'POST' else 'unliked',
+            'changed': changed,
+            'likes_count': comment.likes_count,
+        }, status=status.HTTP_200_OK)
 
     
     def update(self, request, *args, **kwargs):
@@ -132,19 +356,78 @@ class CommentViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Comment is already deleted.'}, status=status.HTTP_400_BAD_REQUEST)
         if comment.user != request.user:
             return Response({'detail': 'You are not the author of this comment.'}, status=status.HTTP_403_FORBIDDEN)
-        comment.is_deleted = True
-        comment.save()
+        with transaction.atomic():
+            if not comment.soft_delete():
+                # A concurrent request deleted it after it was loaded
+                return Response({'detail': 'Comment is already deleted.'}, status=status.HTTP_400_BAD_REQUEST)
+            # update() sends no post_save
+            thread_cache.invalidate_comment(comment)
+            publish_comment_event('comment.deleted', comment, {'id': comment.pk, 'parent': comment.parent_id})
         return Response({'status': 'comment marked as deleted'}, status=status.HTTP_204_NO_CONTENT)
     
 
 
     
+    @conditional_read
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        search = CommentSearchFilter.get_search_text(request)
+        if not search:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        attach_headlines(page, search, get_search_config(request))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
 
 
 
+async def thread_events(request, thread_id):
+    """
+    Server-Sent Events stream of a thread's comment events.
+
+    Serve under ASGI (uvicorn): each open stream is an idle coroutine waiting
+    on its queue, not a worker thread.
+    """
+    channel = thread_channel(request.tenant.schema_name, thread_id)
+
+    async def stream():
+        async with events.backend.subscribe(channel) as queue:
+            yield f'retry: {settings.COMMENT_EVENTS_RETRY_MS}\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=settings.COMMENT_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                event_type = json.loads(message)['type']
+                yield f'event: {event_type}\ndata: {message}\n\n'
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class NotificationPreferenceView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(responses=NotificationPreferenceSerializer)
+    def get(self, request):
+        preference = NotificationPreference.objects.filter(user=request.user).first()
+        if preference is None:
+            preference = NotificationPreference(user=request.user, mode=settings.NOTIFICATION_DEFAULT_MODE)
+        return Response(NotificationPreferenceSerializer(preference).data)
+
+    @extend_schema(request=NotificationPreferenceSerializer, responses=NotificationPreferenceSerializer)
+    def put(self, request):
+        preference = NotificationPreference.objects.filter(user=request.user).first()
+        serializer = NotificationPreferenceSerializer(preference, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data)
+
+
 class GoogleLogin(SocialLoginView):
     adapter_class = GoogleOAuth2Adapter
 
@@ -178,8 +461,10 @@ class GoogleLogin(SocialLoginView):
         400: OpenApiTypes.OBJECT,
     }
 )
-class AnonymousLoginView(APIView):
-    
+class AnonymousLoginView(RateLimitHeadersMixin, APIView):
+    # Every call may create a user; limited per client IP
+    throttle_scope = 'anonymous_login'
+
     def post(self, request):
         username = request.data.get("username")
         email = request.data.get("email")
@@ -192,7 +477,7 @@ class AnonymousLoginView(APIView):
             "password": self._generate_random_password()
         })
 
-        token, _ = Token.objects.get_or_create(user=user)
+        token = create_token(Token, user)
 
         return Response({
             "user": {
@@ -1,31 +1,81 @@
 from django.contrib import admin
-from django.core.management import call_command
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django_tenants.utils import get_public_schema_name
 import psycopg2
 
 
 # Register your models here.
 from django_tenants.admin import TenantAdminMixin
 
-from tenants.models import Client, Domain
+from tenants.models import Client, Domain, SchemaMigration, ThreadActivity
+from tenants.provisioning import provision_in_background
 
 @admin.register(Client)
 class ClientAdmin(TenantAdminMixin, admin.ModelAdmin):
-    list_display = ('name', 'created_on')
+    list_display = ('name', 'created_on', 'provisioning')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Changing it rebuilds the tenant's search column; see `manage.py set_search_config`
+        if obj is not None:
+            return ('search_config',)
+        return ()
+
+    def get_queryset(self, request):
+        provisioning = SchemaMigration.objects.filter(
+            run=SchemaMigration.PROVISION, schema_name=OuterRef('schema_name'),
+        ).values('status')
+        return super().get_queryset(request).annotate(provisioning_status=Subquery(provisioning))
+
+    @admin.display(description='Schema')
+    def provisioning(self, obj):
+        return obj.provisioning_status or 'ready'
 
     def save_model(self, request, obj, form, change):
         is_new = obj._state.adding
+        if is_new:
+            # Building the schema takes longer than a request may; do it in the background
+            obj.auto_create_schema = False
         super().save_model(request, obj, form, change)
 
-        if is_new:     
-            # try:
-            #     obj.create_schema()
-            # except psycopg2.ProgrammingError:
-            #     print(f"Schema {obj.schema_name} already exists.")
-            call_command('migrate_schemas', schema_name=obj.schema_name)
+        if is_new:
+            provision_in_background(obj)
 
 
 
 @admin.register(Domain)
 class DomainAdmin(admin.ModelAdmin):
     list_display = ("domain", "tenant", "is_primary")
-    list_filter = ("tenant", "is_primary")
\ No newline at end of file
+    list_filter = ("tenant", "is_primary")
+
+
+@admin.register(SchemaMigration)
+class SchemaMigrationAdmin(admin.ModelAdmin):
+    list_display = ('run', 'schema_name', 'status', 'duration', 'started_at', 'finished_at')
+    list_filter = ('status', 'run')
+    search_fields = ('schema_name',)
+    readonly_fields = ('started_at', 'finished_at', 'duration', 'error', 'created_at')
+
+
+
+@admin.register(ThreadActivity)
+class ThreadActivityAdmin(admin.ModelAdmin):
+    """Read-only; rows are written by `rollup_activity`."""
+    list_display = ('tenant', 'thread_id', 'day', 'comments', 'replies', 'likes', 'active_users', 'deleted')
+    list_filter = ('tenant', 'day')
+    search_fields = ('thread_id',)
+    list_select_related = ('tenant',)
+    date_hierarchy = 'day'
+
+    def has_view_permission(self, request, obj=None):
+        # Cross-tenant data: only from the public schema's admin
+        return connection.schema_name == get_public_schema_name() and super().has_view_permission(request, obj)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
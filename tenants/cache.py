@@ -0,0 +1,67 @@
+"""
+In-process cache of hostname -> tenant for CachedTenantMiddleware.
+
+Entries expire after TENANT_CACHE_TIMEOUT seconds and the least recently
+used ones are dropped past TENANT_CACHE_SIZE. Client/Domain changes clear the
+cache of the process that made them (tenants.signals); other processes see
+them once their entries expire.
+
+comments.authentication uses the same class for token -> user lookups.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TenantCache:
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """Return `(found, value)`; a cached tenant of None records an unknown hostname."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def discard(self, predicate):
+        """Drop the entries for which `predicate(key, value)` is true."""
+        with self._lock:
+            for key in [key for key, (_, value) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+tenant_cache = TenantCache(settings.TENANT_CACHE_SIZE, settings.TENANT_CACHE_TIMEOUT)
@@ -0,0 +1,86 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django_tenants.utils import get_public_schema_name, get_tenant_model
+
+from tenants.models import SchemaMigration
+from tenants.provisioning import migrate_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Migrate tenant schemas concurrently, recording per-schema progress in SchemaMigration. "
+        "A failed or interrupted run continues with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.TENANT_MIGRATION_PROCESSES)
+        parser.add_argument(
+            '--resume', nargs='?', const='latest', metavar='RUN',
+            help='Continue a run (default: the latest) with the schemas it has not finished',
+        )
+        parser.add_argument('--schema', dest='schema_names', action='append', help='Only these schemas (repeatable)')
+        parser.add_argument('--skip-shared', action='store_true', help='Do not migrate the public schema first')
+
+    def handle(self, *args, **options):
+        if not options['skip_shared']:
+            call_command('migrate_schemas', shared=True, interactive=False, verbosity=0)
+
+        run = self.prepare_run(options)
+        pending = list(
+            SchemaMigration.objects.filter(run=run).exclude(status=SchemaMigration.Status.DONE)
+            .values_list('schema_name', flat=True)
+        )
+        self.stdout.write(f"Run {run}: migrating {len(pending)} schema(s) with {options['processes']} process(es)")
+
+        # Workers are forked and open their own connections; none may be inherited
+        connections.close_all()
+        failed = []
+        with ProcessPoolExecutor(
+            max_workers=max(1, options['processes']), mp_context=multiprocessing.get_context('fork'),
+        ) as pool:
+            futures = {pool.submit(migrate_schema, run, schema_name): schema_name for schema_name in pending}
+            for future in as_completed(futures):
+                schema_name = futures[future]
+                error = future.result()
+                if error:
+                    failed.append(schema_name)
+                    self.stderr.write(f"{schema_name}: failed\n{error}")
+                else:
+                    self.stdout.write(f"{schema_name}: done")
+
+        self.report(run)
+        if failed:
+            raise CommandError(f"{len(failed)} schema(s) failed; fix and rerun with --resume {run}")
+
+    def prepare_run(self, options):
+        if options['resume']:
+            runs = SchemaMigration.objects.exclude(run=SchemaMigration.PROVISION)
+            if options['resume'] != 'latest':
+                runs = runs.filter(run=options['resume'])
+            run = runs.order_by('-created_at').values_list('run', flat=True).first()
+            if run is None:
+                raise CommandError('No run to resume')
+            return run
+
+        run = timezone.now().strftime('%Y%m%d-%H%M%S')
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema_names']:
+            tenants = tenants.filter(schema_name__in=options['schema_names'])
+        SchemaMigration.objects.bulk_create([
+            SchemaMigration(run=run, schema_name=schema_name)
+            for schema_name in tenants.values_list('schema_name', flat=True)
+        ])
+        return run
+
+    def report(self, run):
+        rows = SchemaMigration.objects.filter(run=run).order_by('-duration')
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{"schema":<40} {"status":<8} {"seconds":>8}'))
+        for row in rows:
+            seconds = f'{row.duration:.2f}' if row.duration is not None else '-'
+            self.stdout.write(f'{row.schema_name:<40} {row.status:<8} {seconds:>8}')
@@ -0,0 +1,36 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django_tenants.utils import get_public_schema_name, get_tenant_model
+
+from tenants.rollups import refresh_tenant_in_thread
+
+
+class Command(BaseCommand):
+    help = "Refresh the cross-tenant ThreadActivity rollups from each tenant's comments, incrementally"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Refresh every tenant once and exit')
+        parser.add_argument('--interval', type=float, default=300.0, help='Seconds between refreshes')
+        parser.add_argument('--workers', type=int, default=4, help='Tenants refreshed concurrently')
+        parser.add_argument('--full', action='store_true', help='Recount everything instead of what changed')
+        parser.add_argument('--schema', dest='schema_name', help='Only refresh this tenant schema')
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh(options)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh(self, options):
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schema_name']:
+            tenants = tenants.filter(schema_name=options['schema_name'])
+        tenants = list(tenants)
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            results = pool.map(lambda tenant: refresh_tenant_in_thread(tenant, options['full']), tenants)
+            for tenant, written in zip(tenants, results):
+                self.stdout.write(f"{tenant.schema_name}: {written} bucket(s) updated")
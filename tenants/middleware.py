@@ -0,0 +1,33 @@
+import copy
+import time
+
+from django_tenants.middleware.main import TenantMainMiddleware
+
+from .cache import tenant_cache
+
+
+class CachedTenantMiddleware(TenantMainMiddleware):
+    """
+    TenantMainMiddleware that remembers which tenant a hostname resolves to
+    (see tenants.cache), so most requests skip the Domain/Client query.
+    """
+
+    def process_request(self, request):
+        # Read by comments.metrics.RequestMetricsMiddleware
+        started = time.perf_counter()
+        response = super().process_request(request)
+        request.tenant_lookup_seconds = time.perf_counter() - started
+        return response
+
+    def get_tenant(self, domain_model, hostname):
+        found, tenant = tenant_cache.get(hostname)
+        if not found:
+            try:
+                tenant = super().get_tenant(domain_model, hostname)
+            except domain_model.DoesNotExist:
+                tenant = None
+            tenant_cache.set(hostname, tenant)
+        if tenant is None:
+            raise domain_model.DoesNotExist(f'No domain {hostname!r}')
+        # Requests set attributes such as domain_url on their tenant; keep the cached one pristine
+        return copy.copy(tenant)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0003_schemamigration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_through', models.DateTimeField()),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('tenant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='activity_watermark', to='tenants.client')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ThreadActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thread_id', models.TextField()),
+                ('day', models.DateField()),
+                ('comments', models.PositiveIntegerField(default=0)),
+                ('replies', models.PositiveIntegerField(default=0)),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('active_users', models.PositiveIntegerField(default=0)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_activity', to='tenants.client')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day'], name='thread_activity_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tenant', 'thread_id', 'day'), name='thread_activity_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:51
+
+import comments.throttling
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0004_thread_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='throttle_rates',
+            field=models.JSONField(blank=True, default=dict, validators=[comments.throttling.validate_throttle_rates]),
+        ),
+    ]
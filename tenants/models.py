@@ -1,11 +1,81 @@
 from django.db import models
 from django_tenants.models import TenantMixin, DomainMixin
 
+from comments.throttling import validate_throttle_rates
+
 class Client(TenantMixin):
     name = models.CharField(max_length=100)
     created_on = models.DateField(auto_now_add=True)
+    # Postgres text search configuration of the tenant's comment search
+    # (`\dF` in psql lists them); change it with `manage.py set_search_config`
+    search_config = models.CharField(max_length=63, default='english')
+    # Overrides of REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] by scope, e.g. {"comment_write": "10/minute"}
+    throttle_rates = models.JSONField(default=dict, blank=True, validators=[validate_throttle_rates])
 
     auto_create_schema = True
 
 class Domain(DomainMixin):
-    pass
\ No newline at end of file
+    pass
+
+
+class SchemaMigration(models.Model):
+    """Progress of one schema in a `migrate_tenants` run, or of a tenant being provisioned (run 'provision')."""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    PROVISION = 'provision'
+
+    run = models.CharField(max_length=64)
+    schema_name = models.CharField(max_length=63)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'schema_name'], name='schema_migration_run_schema_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.run}/{self.schema_name}: {self.status}'
+
+class ThreadActivity(models.Model):
+    """
+    Per-tenant, per-thread, per-day comment rollup, kept in the public schema
+    by `rollup_activity` so cross-tenant statistics never touch tenant schemas.
+    Comments count on the day they were created, and so do their likes.
+    """
+    tenant = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='thread_activity')
+    thread_id = models.TextField()
+    day = models.DateField()
+
+    comments = models.PositiveIntegerField(default=0)
+    replies = models.PositiveIntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0)
+    active_users = models.PositiveIntegerField(default=0)  # distinct commenters that day
+    deleted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['tenant', 'thread_id', 'day'], name='thread_activity_uniq'),
+        ]
+        indexes = [models.Index(fields=['day'], name='thread_activity_day_idx')]
+
+    def __str__(self):
+        return f'{self.tenant_id}/{self.thread_id}/{self.day}'
+
+
+class ActivityWatermark(models.Model):
+    """Newest Comment.updated_at already folded into a tenant's ThreadActivity rows."""
+    tenant = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='activity_watermark')
+    updated_through = models.DateTimeField()
+    refreshed_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,70 @@
+"""
+Creating and migrating tenant schemas outside the request that asked for it.
+
+`migrate_schema` does the work for one schema and records its progress in a
+SchemaMigration row. `migrate_tenants` runs it for many schemas in a process
+pool; ClientAdmin runs it for a new tenant in a background thread.
+"""
+import threading
+import time
+import traceback
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from django_tenants.utils import schema_exists
+
+from .models import SchemaMigration
+
+
+def migrate_schema(run, schema_name):
+    """
+    Create `schema_name` if it is missing and apply the tenant migrations.
+    Returns the error text, or '' on success. Safe to call again after a failure.
+    """
+    started = time.monotonic()
+    SchemaMigration.objects.filter(run=run, schema_name=schema_name).update(
+        status=SchemaMigration.Status.RUNNING, started_at=timezone.now(), error='',
+    )
+    error = ''
+    try:
+        if not schema_exists(schema_name):
+            with connection.cursor() as cursor:
+                cursor.execute(f'CREATE SCHEMA "{schema_name}"')
+        call_command(
+            'migrate_schemas', tenant=True, schema_name=schema_name, interactive=False,
+            verbosity=0, stdout=StringIO(),
+        )
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        connection.set_schema_to_public()
+
+    done = SchemaMigration.objects.filter(run=run, schema_name=schema_name)
+    if not error and run != SchemaMigration.PROVISION:
+        # A provisioning cut short (e.g. by a restart) is completed by this run too
+        done = done | SchemaMigration.objects.filter(run=SchemaMigration.PROVISION, schema_name=schema_name)
+    done.update(
+        status=SchemaMigration.Status.FAILED if error else SchemaMigration.Status.DONE,
+        finished_at=timezone.now(),
+        duration=time.monotonic() - started,
+        error=error,
+    )
+    return error
+
+
+def provision_in_background(tenant):
+    """Queue the schema of a newly saved tenant and build it once the transaction commits."""
+    SchemaMigration.objects.update_or_create(
+        run=SchemaMigration.PROVISION, schema_name=tenant.schema_name,
+        defaults={'status': SchemaMigration.Status.QUEUED, 'error': ''},
+    )
+
+    def work():
+        try:
+            migrate_schema(SchemaMigration.PROVISION, tenant.schema_name)
+        finally:
+            connection.close()
+
+    transaction.on_commit(lambda: threading.Thread(target=work, name=f'provision-{tenant.schema_name}', daemon=True).start())
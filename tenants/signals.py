@@ -1,10 +1,19 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.core.management import call_command
-from tenants.models import Client
+
+from tenants.cache import tenant_cache
+from tenants.models import Client, Domain
 
 # @receiver(post_save, sender=Client)
 # def run_tenant_migrations(sender, instance, created, **kwargs):
 #     if created:
 #         # Automatically apply all migrations to this tenant
-#         call_command("migrate_schemas", schema_name=instance.schema_name)
\ No newline at end of file
+#         call_command("migrate_schemas", schema_name=instance.schema_name)
+
+
+@receiver([post_save, post_delete], sender=Client)
+@receiver([post_save, post_delete], sender=Domain)
+def clear_tenant_cache(sender, **kwargs):
+    # Tenants and domains rarely change; dropping every hostname is simplest
+    tenant_cache.clear()
@@ -1,3 +1,122 @@
-from django.test import TestCase
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client as HttpClient, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.utils import get_public_schema_name
+from rest_framework.authtoken.models import Token
+
+from .cache import TenantCache, tenant_cache
+from .models import Client, Domain, ThreadActivity
+
+
+class TenantCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        lru = TenantCache(maxsize=2, timeout=60)
+        lru.set('a.example.com', 'a')
+        lru.set('b.example.com', 'b')
+        lru.get('a.example.com')
+        lru.set('c.example.com', 'c')
+        self.assertEqual(lru.get('b.example.com'), (False, None))
+        self.assertEqual(lru.get('a.example.com'), (True, 'a'))
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        lru = TenantCache(maxsize=10, timeout=60)
+        with mock.patch('tenants.cache.time.monotonic', return_value=1000):
+            lru.set('a.example.com', 'a')
+        with mock.patch('tenants.cache.time.monotonic', return_value=1059):
+            self.assertEqual(lru.get('a.example.com'), (True, 'a'))
+        with mock.patch('tenants.cache.time.monotonic', return_value=1060):
+            self.assertEqual(lru.get('a.example.com'), (False, None))
+
+    def test_unknown_hostname_is_cached_as_none(self):
+        lru = TenantCache(maxsize=10, timeout=60)
+        lru.set('nowhere.example.com', None)
+        self.assertEqual(lru.get('nowhere.example.com'), (True, None))
+
+
+class CachedTenantMiddlewareTests(TenantTestCase):
+    def setUp(self):
+        tenant_cache.clear()
+        self.client = HttpClient(HTTP_HOST=self.domain.domain)
+
+    def lookups(self):
+        # Domain/Client queries of one request (the view itself runs none for anonymous users)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/tenants/cache-stats/')
+        return [query['sql'] for query in queries if 'tenants_domain' in query['sql']]
+
+    def test_hostname_is_resolved_once(self):
+        hits = tenant_cache.stats()['hits']
+        self.assertEqual(len(self.lookups()), 1)
+        self.assertEqual(self.lookups(), [])
+        self.assertEqual(tenant_cache.stats()['hits'], hits + 1)
+
+    def test_domain_changes_clear_the_cache(self):
+        self.client.get('/api/tenants/cache-stats/')
+        Domain.objects.create(tenant=self.tenant, domain='alias.test.com')
+        self.assertEqual(tenant_cache.stats()['size'], 0)
+
+
+class ActivityViewTests(TenantTestCase):
+    """Cross-tenant rollups are for staff of the public schema, signed in through the admin."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connection.set_schema_to_public()
+        cls.public = Client.objects.create(schema_name=get_public_schema_name(), name='Public')
+        cls.public_domain = Domain.objects.create(tenant=cls.public, domain='public.test.com')
+        settings.ALLOWED_HOSTS += ['public.test.com']
+
+    @classmethod
+    def tearDownClass(cls):
+        settings.ALLOWED_HOSTS.remove('public.test.com')
+        connection.set_schema_to_public()
+        cls.public_domain.delete()
+        cls.public.delete()
+        super().tearDownClass()
+
+    def setUp(self):
+        tenant_cache.clear()
+        connection.set_schema_to_public()
+        self.addCleanup(connection.set_tenant, self.tenant)
+        ThreadActivity.objects.create(tenant=self.tenant, thread_id='chart-1', day=date(2026, 1, 1), comments=4, deleted=1)
+        self.admin = User.objects.create_user('admin', 'admin@example.com', is_staff=True)
+
+    def get(self, host, **headers):
+        return HttpClient(HTTP_HOST=host, **headers).get('/api/tenants/activity/')
+
+    def test_public_staff_session(self):
+        client = HttpClient(HTTP_HOST='public.test.com')
+        client.force_login(self.admin)
+        response = client.get('/api/tenants/activity/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [{
+            'schema': 'test', 'comments': 4, 'replies': 0, 'likes': 0, 'active_users': 0, 'deleted': 1,
+            'deleted_ratio': 0.25,
+        }])
+
+    def test_public_users_who_are_not_staff(self):
+        client = HttpClient(HTTP_HOST='public.test.com')
+        client.force_login(User.objects.create_user('visitor'))
+        self.assertEqual(client.get('/api/tenants/activity/').status_code, 403)
+        self.assertEqual(self.get('public.test.com').status_code, 403)
+
+    def test_tenant_users_are_refused(self):
+        connection.set_tenant(self.tenant)
+        staff = User.objects.create_user('staff', is_staff=True)
+        token = Token.objects.create(user=staff)
+        authorization = f'Token {token.key}'
+        # Tokens authenticate nobody here, on the tenant's domain or the public one
+        self.assertEqual(self.get(self.domain.domain, HTTP_AUTHORIZATION=authorization).status_code, 403)
+        self.assertEqual(self.get('public.test.com', HTTP_AUTHORIZATION=authorization).status_code, 403)
+        connection.set_tenant(self.tenant)
+        client = HttpClient(HTTP_HOST=self.domain.domain)
+        client.force_login(staff)
+        self.assertEqual(client.get('/api/tenants/activity/').status_code, 403)
@@ -1,3 +1,94 @@
-from django.shortcuts import render
+from django.db import connection
+from django.db.models import F, Sum
+from django_tenants.utils import get_public_schema_name
+from rest_framework import permissions, serializers
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from .cache import tenant_cache
+from .models import ThreadActivity
+
+
+class IsPublicSchemaAdmin(permissions.IsAdminUser):
+    """Staff of the public schema; cross-tenant data must not be readable from a tenant's domain."""
+
+    def has_permission(self, request, view):
+        return connection.schema_name == get_public_schema_name() and super().has_permission(request, view)
+
+
+class TenantCacheStatsView(APIView):
+    """Hit rate of this process's hostname -> tenant cache (CachedTenantMiddleware)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(tenant_cache.stats())
+
+
+class ActivityQuerySerializer(serializers.Serializer):
+    group_by = serializers.ChoiceField(choices=['tenant', 'thread', 'day'], default='tenant')
+    schema = serializers.CharField(required=False, help_text='Only this tenant schema')
+    thread_id = serializers.CharField(required=False)
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+
+class ActivityPagination(PageNumberPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class ActivityView(APIView):
+    """
+    Cross-tenant comment activity from the ThreadActivity rollups (see
+    `rollup_activity`); reads the public schema only. active_users is
+    summed over days, i.e. user-days.
+
+    Authenticates with the admin's session: API tokens live in tenant
+    schemas only (rest_framework.authtoken is a tenant app).
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsPublicSchemaAdmin]
+    groups = {
+        'tenant': ['tenant__schema_name'],
+        'thread': ['tenant__schema_name', 'thread_id'],
+        'day': ['tenant__schema_name', 'day'],
+    }
+
+    def get(self, request):
+        params = ActivityQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+
+        rows = ThreadActivity.objects.all()
+        if 'schema' in params:
+            rows = rows.filter(tenant__schema_name=params['schema'])
+        if 'thread_id' in params:
+            rows = rows.filter(thread_id=params['thread_id'])
+        if 'since' in params:
+            rows = rows.filter(day__gte=params['since'])
+        if 'until' in params:
+            rows = rows.filter(day__lte=params['until'])
+
+        group = self.groups[params['group_by']]
+        rows = (
+            rows.values(*group)
+            .annotate(
+                schema=F('tenant__schema_name'),
+                comments=Sum('comments'),
+                replies=Sum('replies'),
+                likes=Sum('likes'),
+                active_users=Sum('active_users'),
+                deleted=Sum('deleted'),
+            )
+            .values('schema', *group[1:], 'comments', 'replies', 'likes', 'active_users', 'deleted')
+            .order_by(*group)
+        )
+
+        paginator = ActivityPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        for row in page:
+            row['deleted_ratio'] = row['deleted'] / row['comments'] if row['comments'] else 0.0
+        return paginator.get_paginated_response(page)